@@ -0,0 +1,126 @@
+# Headless arena: play two players against each other in a process pool and rate them.
+import argparse
+import importlib
+import math
+import multiprocessing
+import os
+import sys
+import time
+
+from game import GomokuGame
+
+
+def player_class(name):
+    """Return the player class named name, looked up in player unless given as module.Class."""
+    module, _, cls = name.rpartition('.')
+    return getattr(importlib.import_module(module or 'player'), cls)
+
+
+def _silence():
+    sys.stdout = open(os.devnull, 'w')
+
+
+def _time_moves(player, latencies):
+    """Make player record the seconds every think call takes in latencies."""
+    think = player.think
+
+    def timed_think(game):
+        start = time.time()
+        move = think(game)
+        latencies.append(time.time() - start)
+        return move
+    player.think = timed_think
+
+
+def play_game(args):
+    """Play game number index between the players named first and second, first playing black in even games.
+
+    Return (score of first, move latencies of first, move latencies of second, forfeit). A player
+    whose think raises or returns an illegal move loses the game by forfeit.
+    """
+    index, first, second = args
+    swap = index % 2 == 1
+    black, white = (second, first) if swap else (first, second)
+    game = GomokuGame(player_class(black), player_class(white))
+    latencies = {'b': [], 'w': []}
+    for player in game.players:
+        _time_moves(player, latencies[player.stone_color])
+
+    forfeit = False
+    try:
+        game.start()
+        state = game.board.get_state()
+    except Exception:
+        forfeit = True
+        state = 2 if game.current_player.stone_color == 'b' else 1
+    score = {1: 1., 2: 0., 3: .5}[state]
+    if swap:
+        return 1. - score, latencies['w'], latencies['b'], forfeit
+    return score, latencies['b'], latencies['w'], forfeit
+
+
+def elo(score):
+    """Return the Elo difference that gives an expected score of score."""
+    if score <= 0.:
+        return -float('inf')
+    if score >= 1.:
+        return float('inf')
+    return -400. * math.log10(1. / score - 1.)
+
+
+def rate(scores, z=1.96):
+    """Return (elo, low, high) of the first player from its game scores, with a z-score confidence interval.
+
+    The scores get a prior of one drawn game, so that a player winning or losing every game still gets
+    finite bounds, and the interval is the Wilson score interval of the mean score.
+    """
+    if not scores:
+        return 0., -float('inf'), float('inf')
+    n = len(scores) + 1
+    mean = (sum(scores) + .5) / n
+    center = (mean + z * z / (2 * n)) / (1 + z * z / n)
+    margin = z * math.sqrt(mean * (1 - mean) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+    return elo(mean), elo(center - margin), elo(center + margin)
+
+
+def run(first, second, num_games, workers=multiprocessing.cpu_count()):
+    """Play num_games games between the players named first and second, alternating colors.
+
+    Print win/draw/loss, Elo of first with a 95% confidence interval, mean move latencies and
+    games/sec, and return them in a dictionary.
+    """
+    # players may hold TensorFlow sessions, so workers are spawned, not forked
+    context = multiprocessing.get_context('spawn')
+    start = time.time()
+    scores = []
+    latencies = [[], []]
+    forfeits = 0
+    with context.Pool(workers, initializer=_silence) as pool:
+        games = [(i, first, second) for i in range(num_games)]
+        for score, first_latencies, second_latencies, forfeit in pool.imap_unordered(play_game, games):
+            scores.append(score)
+            latencies[0] += first_latencies
+            latencies[1] += second_latencies
+            forfeits += forfeit
+    elapsed = time.time() - start
+
+    result = {'wins': scores.count(1.), 'draws': scores.count(.5), 'losses': scores.count(0.),
+              'forfeits': forfeits, 'elo': rate(scores), 'games_per_sec': num_games / elapsed,
+              'latency': [sum(values) / len(values) if values else 0. for values in latencies]}
+    print('%s vs %s: %d wins, %d draws, %d losses (%d forfeits)' %
+          (first, second, result['wins'], result['draws'], result['losses'], forfeits))
+    print('Elo %+.0f (95%% interval %+.0f to %+.0f)' % result['elo'])
+    for name, latency in zip([first, second], result['latency']):
+        print('%s: %.1f ms per move' % (name, latency * 1000))
+    print('%.2f games/sec' % result['games_per_sec'])
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Play two players against each other without the GUI.')
+    parser.add_argument('first', help='player class, from player.py unless given as module.Class')
+    parser.add_argument('second')
+    parser.add_argument('-n', '--games', type=int, default=100)
+    parser.add_argument('-w', '--workers', type=int, default=multiprocessing.cpu_count())
+    args = parser.parse_args()
+    run(args.first, args.second, args.games, args.workers)
@@ -0,0 +1,168 @@
+# Vectorized feature extraction for many boards at once.
+import numpy as np
+
+from utils import file_to_patterns, line_tables
+
+STONE_CODES = {'.': 0, 'b': 1, 'w': 2}
+
+
+def boards_to_array(boards):
+    """Convert boards in list representation into an (N, size, size) int8 array."""
+    return np.array([[[STONE_CODES[s] for s in row] for row in board] for board in boards], dtype=np.int8)
+
+
+def next_boards_array(board, moves, stone_color):
+    """Return an (N, size, size) array with stone_color put on each of the N moves.
+
+    :param board: A (size, size) int8 array.
+    :param moves: List of (row, col).
+    :param stone_color: 'b' or 'w'.
+    """
+    moves = np.asarray(moves, dtype=np.intp).reshape(-1, 2)
+    boards = np.repeat(board[np.newaxis], len(moves), axis=0)
+    boards[np.arange(len(moves)), moves[:, 0], moves[:, 1]] = STONE_CODES[stone_color]
+    return boards
+
+
+def _build_window_index(length, size):
+    windows = []
+    for line in line_tables(size)[0]:
+        for i in range(len(line) - length + 1):
+            windows.append([r * size + c for r, c in line[i:i + length]])
+    return np.array(windows, dtype=np.intp).reshape(-1, length)
+
+
+_window_indices = {}
+
+
+def _window_index(length, size=15):
+    """Return a (W, length) array with the flat cell indices of every window of the given length.
+
+    The windows cover the same lines as utils.pattern_occurrence on a size x size board: rows, columns
+    and both diagonals. The arrays are built on first use.
+    """
+    if (length, size) not in _window_indices:
+        _window_indices[length, size] = _build_window_index(length, size)
+    return _window_indices[length, size]
+
+
+class BatchFeatureExtractor:
+    """Compute utils.extract_features for a batch of boards with NumPy.
+
+    Every window of a pattern's length is gathered from the flattened boards
+    and reduced to a base-3 code with one dot product, which is compared with
+    the codes of the patterns and their reversals.
+    """
+    def __init__(self, patterns):
+        if isinstance(patterns, str):
+            patterns = file_to_patterns(patterns)
+        self.patterns = list(patterns)
+        self._is_five = np.array(['bbbbb' in p or 'wwwww' in p for p in self.patterns])
+
+        self._groups = []
+        for length in sorted(set(len(p) for p in self.patterns)):
+            weights = 3 ** np.arange(length, dtype=np.int32)
+            codes, owners = [], []
+            for i, p in enumerate(self.patterns):
+                if len(p) != length:
+                    continue
+                for s in {p, p[::-1]}:
+                    codes.append(int(np.dot([STONE_CODES[c] for c in s], weights)))
+                    owners.append(i)
+            self._groups.append((length, weights, codes, owners))
+
+        self.num_features = int(np.sum(np.where(self._is_five, 1, 5))) + 2 * len(self.patterns)
+
+    def occurrence(self, boards):
+        """Return an (N, P) int32 array of pattern occurrence for (N, size, size) boards."""
+        boards = np.asarray(boards, dtype=np.int8)
+        flat = boards.reshape(len(boards), -1).astype(np.int32)
+        occurrence = np.zeros((len(boards), len(self.patterns)), dtype=np.int32)
+        for length, weights, codes, owners in self._groups:
+            keys = flat[:, _window_index(length, boards.shape[1])].dot(weights)
+            for code, owner in zip(codes, owners):
+                occurrence[:, owner] += np.count_nonzero(keys == code, axis=1)
+        return occurrence
+
+    def features(self, boards):
+        """Return an (N, F) float32 feature matrix for (N, size, size) boards."""
+        boards = np.asarray(boards, dtype=np.int8)
+        n = len(boards)
+        black_to_move = np.count_nonzero(boards.reshape(n, -1), axis=1) % 2 == 0
+        return self.features_from_occurrence(self.occurrence(boards), black_to_move)
+
+    def features_from_occurrence(self, occurrence, black_to_move):
+        """Return an (N, F) float32 feature matrix from an (N, P) occurrence array and whose turn it is."""
+        occurrence = np.asarray(occurrence)
+        n = len(occurrence)
+        columns = []
+        for i, is_five in enumerate(self._is_five):
+            o = occurrence[:, i]
+            if is_five:
+                columns.append(o > 0)
+                continue
+            columns += [o >= 1, o >= 2, o >= 3, o >= 4, np.where(o >= 5, (o - 4) / 2, 0)]
+
+        for i in range(len(self.patterns)):
+            seen = occurrence[:, i] != 0
+            columns += [seen & black_to_move, seen & ~black_to_move]
+
+        features = np.empty((n, self.num_features), dtype=np.float32)
+        for j, column in enumerate(columns):
+            features[:, j] = column
+        return features
+
+
+_extractors = {}
+
+
+def extract_features_batch(boards, patterns):
+    """Return an (N, F) float32 feature matrix, like utils.extract_features applied to each board.
+
+    :param boards: An (N, size, size) int8 array. See boards_to_array.
+    :param patterns: Pattern list or the file name from which to read the patterns.
+    """
+    key = patterns if isinstance(patterns, str) else tuple(patterns)
+    if key not in _extractors:
+        _extractors[key] = BatchFeatureExtractor(patterns)
+    return _extractors[key].features(boards)
+
+
+if __name__ == '__main__':
+    import random
+    import time
+    from utils import extract_features
+
+    patterns = file_to_patterns('pattern.txt')
+    boards = []
+    for _ in range(225):
+        stones = random.randint(0, 120)
+        board = [['.'] * 15 for _ in range(15)]
+        for n, i in enumerate(random.sample(range(225), stones)):
+            board[i // 15][i % 15] = 'bw'[n % 2]
+        boards.append(board)
+
+    start = time.time()
+    expected = [extract_features(board, patterns) for board in boards]
+    loop_time = time.time() - start
+
+    array = boards_to_array(boards)
+    extract_features_batch(array[:1], patterns)
+    start = time.time()
+    features = extract_features_batch(array, patterns)
+    batch_time = time.time() - start
+
+    assert features.shape == (len(boards), len(expected[0]))
+    assert np.array_equal(features, np.array(expected, dtype=np.float32))
+    print('per-board loop: %.1f ms, batch: %.1f ms for %d boards' % (loop_time * 1000, batch_time * 1000, len(boards)))
+
+    for size in (9, 19):
+        boards = []
+        for _ in range(20):
+            board = [['.'] * size for _ in range(size)]
+            for n, i in enumerate(random.sample(range(size * size), random.randint(0, size * size // 2))):
+                board[i // size][i % size] = 'bw'[n % 2]
+            boards.append(board)
+        assert np.array_equal(extract_features_batch(boards_to_array(boards), patterns),
+                              np.array([extract_features(board, patterns) for board in boards], dtype=np.float32))
+    print('9x9 and 19x19 ok')
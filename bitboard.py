@@ -0,0 +1,249 @@
+# Bitboard implementation of the gomoku board.
+from game import Board
+import itertools
+
+from utils import board_lines, get_matcher, line_tables, zobrist_hash, zobrist_keys
+
+# maps the digits of bin() to the bytes 0 and 1, see BitLayout.cells_of
+_BIT_BYTES = str.maketrans('01', '\x00\x01')
+
+
+class BitLayout:
+    """Bit indices of the cells of a size x size board.
+
+    Cells are packed row by row into a Python int, size + 1 bits per row. The
+    last column is never set, so it works as a sentinel that stops runs of
+    stones from wrapping around to the next row when the bitboards are shifted.
+    """
+    def __init__(self, size):
+        self.width = width = size + 1
+        self.full = sum(1 << (r * width + c) for r in range(size) for c in range(size))
+        # shift amounts for the -, |, \ and / directions
+        self.directions = (1, width, width + 1, width - 1)
+        # (row, col) of every bit index, sentinel columns included
+        self.cells = [divmod(i, width) for i in range(size * width)]
+
+    def cells_of(self, bits):
+        """Return the (row, col) of every set bit of bits, in row-major order."""
+        # bin() and compress do the scan in C instead of one Python step per bit
+        return list(itertools.compress(self.cells, bin(bits)[:1:-1].translate(_BIT_BYTES).encode()))
+
+
+_layouts = {}
+
+
+def bit_layout(size):
+    """Return the BitLayout of a size x size board, building it on first use."""
+    if size not in _layouts:
+        _layouts[size] = BitLayout(size)
+    return _layouts[size]
+
+
+def _five_in_a_row(bits, directions, win_length=5):
+    """Return a mask of the first stone of every win_length stones in a row in bits."""
+    mask = 0
+    if win_length == 5:
+        for d in directions:
+            mask |= bits & (bits >> d) & (bits >> 2 * d) & (bits >> 3 * d) & (bits >> 4 * d)
+        return mask
+    for d in directions:
+        run = bits
+        for i in range(1, win_length):
+            run &= bits >> i * d
+        mask |= run
+    return mask
+
+
+def _dilate(bits, layout):
+    """Grow bits by one cell in all eight directions."""
+    bits = (bits | (bits << 1) | (bits >> 1)) & layout.full
+    return (bits | (bits << layout.width) | (bits >> layout.width)) & layout.full
+
+
+class BitBoard(Board):
+    """Drop-in replacement for Board that keeps one integer bitboard per color.
+
+    Copying a BitBoard only copies two ints, the line strings and the
+    occurrence list. The line strings are kept up to date by put_stone like
+    in Board, and moves are read off the empty and nearby masks.
+    """
+    # nearby moves come from dilating the occupied bits, so no candidate tables are kept
+    _nearby = {}
+
+    def __init__(self, board=None, patterns=[], size=15, win_length=5):
+        if isinstance(board, BitBoard):
+            self.size = board.size
+            self.win_length = board.win_length
+            self._layout = board._layout
+            self._cell_lines = board._cell_lines
+            self._zobrist = board._zobrist
+            self._black = board._black
+            self._white = board._white
+            self._lines = list(board._lines)
+            self._num_stone = board._num_stone
+            self._state = board._state
+            self._history = list(board._history)
+            self.hash = board.hash
+            self._patterns = board._patterns
+            self._matcher = board._matcher
+            self.occurrence = list(board.occurrence)
+            return
+
+        if isinstance(board, Board):
+            patterns = board._patterns
+            win_length = board.win_length
+            board = board.board
+        self.size = len(board) if board else size
+        self.win_length = win_length
+        self._layout = bit_layout(self.size)
+        self._cell_lines = line_tables(self.size)[1]
+        self._zobrist = zobrist_keys(self.size)
+        self._black = self._white = 0
+        self._num_stone = 0
+        self._lines = board_lines(board or [['.'] * self.size for _ in range(self.size)])
+        if board:
+            width = self._layout.width
+            for r, row in enumerate(board):
+                for c, stone in enumerate(row):
+                    if stone == 'b':
+                        self._black |= 1 << (r * width + c)
+                        self._num_stone += 1
+                    elif stone == 'w':
+                        self._white |= 1 << (r * width + c)
+                        self._num_stone += 1
+        self._patterns = patterns
+        self._matcher = get_matcher(patterns)
+        self.occurrence = self._matcher.count(self._lines)
+        self._state = self._scan_state()
+        self._history = []
+        self.hash = zobrist_hash(self.board)
+
+    def __repr__(self):
+        s = ''
+        for row in self.board:
+            s += ''.join(row) + '\n'
+        return s
+
+    def _stone_at(self, i):
+        if (self._black >> i) & 1:
+            return 'b'
+        if (self._white >> i) & 1:
+            return 'w'
+        return '.'
+
+    @property
+    def empty_mask(self):
+        """Bits of the empty cells, for callers that can work on the mask instead of a move list."""
+        return self._layout.full & ~(self._black | self._white)
+
+    def get_legal_moves(self):
+        return self._layout.cells_of(self.empty_mask)
+
+    def is_legal_move(self, move):
+        return not ((self._black | self._white) >> (move[0] * self._layout.width + move[1])) & 1
+
+    @property
+    def num_stone(self):
+        return self._num_stone
+
+    @property
+    def board(self):
+        """Return the board as a list of lists, like Board.board"""
+        # the first size lines are the rows
+        return [list(row) for row in self._lines[:self.size]]
+
+    def copy(self):
+        return BitBoard(self)
+
+    def put_stone(self, pos):
+        if not self.is_legal_move(pos):
+            raise Exception('Illegal move')
+
+        row, col = pos
+        bit = 1 << (row * self._layout.width + col)
+        o1 = self._get_occurrence_at(pos)
+        if self._num_stone % 2 == 0:
+            self._black |= bit
+            stones, state, color = self._black, 1, 'b'
+        else:
+            self._white |= bit
+            stones, state, color = self._white, 2, 'w'
+        for line_id, offset in self._cell_lines[row][col]:
+            line = self._lines[line_id]
+            self._lines[line_id] = line[:offset] + color + line[offset + 1:]
+        self._num_stone += 1
+        self.hash ^= self._zobrist[color][row][col]
+        o2 = self._get_occurrence_at(pos)
+        delta = [y - x for x, y in zip(o1, o2)]
+        self.occurrence = [o + d for o, d in zip(self.occurrence, delta)]
+
+        if self._state == 0:
+            if _five_in_a_row(stones, self._layout.directions, self.win_length):
+                self._state = state
+            elif self._num_stone == self.size * self.size:
+                self._state = 3
+        return delta
+
+    def _remove_stone(self, pos):
+        row, col = pos
+        i = row * self._layout.width + col
+        self.hash ^= self._zobrist[self._stone_at(i)][row][col]
+        mask = ~(1 << i)
+        self._black &= mask
+        self._white &= mask
+        for line_id, offset in self._cell_lines[row][col]:
+            line = self._lines[line_id]
+            self._lines[line_id] = line[:offset] + '.' + line[offset + 1:]
+        self._num_stone -= 1
+
+    def get_legal_nearby_moves(self, nearby_length=1):
+        occupied = self._black | self._white
+        nearby = occupied
+        for _ in range(nearby_length):
+            nearby = _dilate(nearby, self._layout)
+        return self._layout.cells_of(nearby & ~occupied) or None
+
+    def get_state(self):
+        """Return board state. 0: none, 1: black, 2: white, 3: board full"""
+        return self._state
+
+    def _scan_state(self):
+        directions = self._layout.directions
+        black = _five_in_a_row(self._black, directions, self.win_length)
+        white = _five_in_a_row(self._white, directions, self.win_length)
+        if black or white:
+            # Board.get_state reports the five whose first stone comes first
+            # in row-major order.
+            if not white or (black and (black & -black) < (white & -white)):
+                return 1
+            return 2
+        return 3 if self._num_stone == self.size * self.size else 0
+
+
+if __name__ == '__main__':
+    import random
+    import timeit
+    from utils import file_to_patterns
+
+    # the parity of BitBoard with Board is checked in tests/test_bitboard.py
+    patterns = file_to_patterns('pattern.txt')
+    moves = []
+    b = Board(patterns=patterns)
+    for _ in range(60):
+        moves.append(random.choice(b.get_legal_nearby_moves(1) or [b.center]))
+        b.put_stone(moves[-1])
+    for cls in (Board, BitBoard):
+        b = cls(patterns=patterns)
+        for move in moves:
+            b.put_stone(move)
+        candidates = b.get_legal_nearby_moves(2)
+
+        def push_pop():
+            for move in candidates:
+                b.push(move)
+                b.pop()
+        timings = [('get_legal_moves', b.get_legal_moves, 1), ('get_legal_nearby_moves(2)', b.get_legal_nearby_moves, 1),
+                   ('copy', b.copy, 1), ('push/pop', push_pop, len(candidates))]
+        print('%s: %s' % (cls.__name__, ', '.join(
+            '%s %.1f us' % (name, min(timeit.repeat(f, number=200, repeat=5)) / 200 / n * 1e6)
+            for name, f, n in timings)))
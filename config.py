@@ -1,2 +1,23 @@
 pattern_num = 11
 pattern_file_name = "pattern.txt"
+# board of board_size x board_size cells where win_length stones in a row win
+board_size = 15
+win_length = 5
+# weights of the pattern occurrence used to shape the rewards between moves
+reward_weights = [10000, 8000, 1000, 1000, 900, 100, 400, 110, 100, 60, 5, 5, 50, 50, -10000, -8000, -1000, -1000, -900, -100, -400, -110, -100, -60, -5, -5, -50, -50]
+# minibatches the critic of ReinforceAIPlayer trains on, see rl_network.replay_buffer.ReplayTrainer
+replay_batch_size = 64
+replay_train_every = 16
+replay_min_size = 256
+# opening book written by opening_book.build_book, used for the first opening_book_plies plies
+opening_book_file = "opening_book.bin"
+opening_book_plies = 10
+opening_book_min_visits = 3
+# number of critic values kept by rl_network.eval_cache.EvaluationCache
+eval_cache_size = 100000
+# directory game_record.GameRecordWriter appends game records to
+record_dir = "records/"
+# seconds an AI player may think in the GUI before it has to play its best move so far
+think_time_limit = 5.
+# show the critic value of every empty cell in the GUI
+value_overlay = True
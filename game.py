@@ -1,70 +1,146 @@
 import copy
-import re
-from utils import diagonal_line, file_to_patterns, pattern_occurrence
+
+import config
+from utils import (board_lines, file_to_patterns, get_matcher, line_tables, neighbourhood, shaped_reward,
+                   zobrist_hash, zobrist_keys)
 
 
 class GomokuGame:
-    def __init__(self, player1_cls, player2_cls):
-        self.board = Board(patterns=file_to_patterns('pattern.txt'))
+    def __init__(self, player1_cls, player2_cls, board_cls=None, executor=None, size=config.board_size,
+                 win_length=config.win_length):
+        self.board = (board_cls or Board)(patterns=file_to_patterns('pattern.txt'), size=size, win_length=win_length)
         self.players = [player1_cls('b'), player2_cls('w')]
-        self._event_callback = lambda event: None
+        # ThinkExecutor running the players' think, or None to call it directly
+        self._executor = executor
+        # functions called with every event; events are not even built while there are none
+        self._observers = []
+        # number of moves played by start
         self.moves = 0
-        self._event_callback = None
         self.test_move = [(7, 7), (3, 2), (7, 8), (2, 4), (7, 9), (7, 2), (7, 10), (11, 2), (7, 11)]
 
     def start(self):
-        state = self.board.get_state()
+        board = self.board
+        observers = self._observers
+        # index of the player to move, kept here instead of being derived from the board every ply
+        turn = board.num_stone % 2
+        state = board.get_state()
         while state == 0:
-            move = self.current_player.think(self)
-            self._event_callback(MoveEvent(self.current_player.stone_color, move))
+            player = self.players[turn]
+            if self._executor is None:
+                move = player.think(self)
+            else:
+                move = self._executor.think(player, self, self._notify if observers else None)
+            if observers:
+                self._notify(MoveEvent(player.stone_color, move))
 
-            self.board.put_stone(move)
-            self._event_callback(BoardUpdateEvent(self.board))
+            board.put_stone(move)
+            self.moves += 1
+            turn ^= 1
+            if observers:
+                self._notify(BoardUpdateEvent(board))
 
-            state = self.board.get_state()
+            state = board.get_state()
 
         print('GG')
-        if state == 1:
-            self._event_callback(GameOverEvent('b'))
-        elif state == 2:
-            self._event_callback(GameOverEvent('w'))
-        elif state == 3:
-            self._event_callback(GameOverEvent())
+        for player in self.players:
+            player.on_game_over(self)
+        if observers:
+            self._notify(GameOverEvent([None, 'b', 'w', None][state], board))
 
     @property
     def current_player(self):
         return self.players[self.board.num_stone % 2]
 
+    def add_observer(self, func):
+        """Call func with every event of the game."""
+        self._observers.append(func)
+
+    def remove_observer(self, func):
+        self._observers.remove(func)
+
     def set_event_callback(self, func):
-        self._event_callback = func
+        """Make func the only observer of the game."""
+        self._observers[:] = [func]
+
+    def _notify(self, event):
+        for observer in self._observers:
+            observer(event)
 
 
 class MoveEvent:
+    __slots__ = ('stone_color', 'move')
+
     def __init__(self, stone_color, move):
         self.stone_color = stone_color
         self.move = move
 
 
+class ProgressEvent:
+    """The best move a player found so far while thinking, with details of its search in info."""
+    __slots__ = ('stone_color', 'move', 'info')
+
+    def __init__(self, stone_color, move, info):
+        self.stone_color = stone_color
+        self.move = move
+        self.info = info
+
+
 class BoardUpdateEvent:
+    __slots__ = ('board',)
+
     def __init__(self, board):
         self.board = board
 
 
 class GameOverEvent:
-    def __init__(self, winner=None):
+    __slots__ = ('winner', 'board')
+
+    def __init__(self, winner=None, board=None):
         self.winner = winner
+        self.board = board
 
 
 class Board:
-    def __init__(self, board=None, patterns=[]):
+    """A size x size board where win_length stones in a row win.
+
+    When board is given in list representation, its size is taken from it.
+    """
+    def __init__(self, board=None, patterns=[], size=15, win_length=5):
         if isinstance(board, Board):
+            self.size = board.size
+            self.win_length = board.win_length
+            self._cell_lines = board._cell_lines
+            self._zobrist = board._zobrist
             self._board = board.board
-            self._patterns = copy.deepcopy(board._patterns)
-            self.occurrence = copy.deepcopy(board.occurrence)
+            self._lines = list(board._lines)
+            # patterns are never modified, so they can be shared
+            self._patterns = board._patterns
+            self.occurrence = list(board.occurrence)
+            self._matcher = board._matcher
+            self._num_stone = board.num_stone
+            self._state = board.get_state()
+            self._history = list(board._history)
+            self.hash = board.hash
+            self._nearby = {nearby_length: ([row[:] for row in counts], set(moves), cells)
+                            for nearby_length, (counts, moves, cells) in board._nearby.items()}
         else:
-            self._board = copy.deepcopy(board) or [['.'] * 15 for _ in range(15)]
+            self.size = len(board) if board else size
+            self.win_length = win_length
+            # tables of the board size, shared by all boards of that size
+            self._cell_lines = line_tables(self.size)[1]
+            self._zobrist = zobrist_keys(self.size)
+            self._board = copy.deepcopy(board) or [['.'] * self.size for _ in range(self.size)]
+            self._lines = board_lines(self._board)
             self._patterns = patterns
-            self.occurrence = pattern_occurrence(self._board, patterns)
+            self._matcher = get_matcher(patterns)
+            self.occurrence = self._matcher.count(self._lines)
+            self._num_stone = sum(stone != '.' for row in self._board for stone in row)
+            self._state = self._scan_state()
+            self._history = []
+            # Zobrist hash of the position, kept up to date by put_stone and pop
+            self.hash = zobrist_hash(self._board)
+            # nearby_length -> (counts, moves, cells), see _nearby_moves
+            self._nearby = {}
 
     def __repr__(self):
         s = ''
@@ -74,9 +150,9 @@ class Board:
 
     def get_legal_moves(self):
         moves = []
-        for row in range(15):
-            for col in range(15):
-                if self._board[row][col] is '.':
+        for row in range(self.size):
+            for col in range(self.size):
+                if self._board[row][col] == '.':
                     moves.append((row, col))
         return moves
 
@@ -85,33 +161,93 @@ class Board:
 
     @property
     def num_stone(self):
-        num = 0
-        for r in range(15):
-            for c in range(15):
-                if self._board[r][c] != '.':
-                    num += 1
-        return num
+        return self._num_stone
+
+    @property
+    def num_legal_moves(self):
+        return self.size * self.size - self._num_stone
+
+    @property
+    def center(self):
+        """The center cell, where the first move goes when there is nothing else to go by."""
+        return self.size // 2, self.size // 2
 
     @property
     def board(self):
         """Return a copy of self._board"""
-        return copy.deepcopy(self._board)
+        return [row[:] for row in self._board]
+
+    def copy(self):
+        """Return an independent copy of this board."""
+        return Board(self)
 
     def put_stone(self, pos):
         """
         First call to this method will place a black stone on the given position and second call
         will place a white stone, and so on.
 
-        This method also updates the pattern occurrence.
+        This method also updates the pattern occurrence and the board state.
+
+        :return: The change in pattern occurrence.
         """
         if not self.is_legal_move(pos):
             raise Exception('Illegal move')
 
         row, col = pos
+        color = self.get_next_stone_color()
         o1 = self._get_occurrence_at(pos)
-        self._board[row][col] = self.get_next_stone_color()
+        self._board[row][col] = color
+        for line_id, offset in self._cell_lines[row][col]:
+            line = self._lines[line_id]
+            self._lines[line_id] = line[:offset] + color + line[offset + 1:]
+        self._num_stone += 1
+        self.hash ^= self._zobrist[color][row][col]
+        for counts, moves, cells in self._nearby.values():
+            moves.discard(pos)
+            for r, c in cells[row][col]:
+                counts[r][c] += 1
+                if self._board[r][c] == '.':
+                    moves.add((r, c))
         o2 = self._get_occurrence_at(pos)
-        self.occurrence = [o + y - x for o, x, y in zip(self.occurrence, o1, o2)]
+        delta = [y - x for x, y in zip(o1, o2)]
+        self.occurrence = [o + d for o, d in zip(self.occurrence, delta)]
+
+        if self._state == 0:
+            if self._is_five_at(pos):
+                self._state = ['b', 'w'].index(color) + 1
+            elif self._num_stone == self.size * self.size:
+                self._state = 3
+        return delta
+
+    def push(self, pos):
+        """Put a stone like put_stone, remembering what pop needs to take it back.
+
+        :return: The change in pattern occurrence.
+        """
+        self._history.append((pos, self.occurrence, self._state))
+        return self.put_stone(pos)
+
+    def pop(self):
+        """Take back the last stone put by push. Return its position."""
+        pos, self.occurrence, self._state = self._history.pop()
+        self._remove_stone(pos)
+        return pos
+
+    def _remove_stone(self, pos):
+        row, col = pos
+        self.hash ^= self._zobrist[self._board[row][col]][row][col]
+        self._board[row][col] = '.'
+        for line_id, offset in self._cell_lines[row][col]:
+            line = self._lines[line_id]
+            self._lines[line_id] = line[:offset] + '.' + line[offset + 1:]
+        self._num_stone -= 1
+        for counts, moves, cells in self._nearby.values():
+            for r, c in cells[row][col]:
+                counts[r][c] -= 1
+                if not counts[r][c]:
+                    moves.discard((r, c))
+            if counts[row][col]:
+                moves.add(pos)
 
     def get_next_stone_color(self):
         return ['b', 'w'][self.num_stone % 2]
@@ -124,21 +260,28 @@ class Board:
 
         Return None if there's no move.
         """
-        moves = []
-        for row, col in self.get_legal_moves():
-            if not self._is_nearby_empty(nearby_length, row, col):
-                moves.append((row, col))
+        return sorted(self._nearby_moves(nearby_length)[1]) or None
 
-        return moves or None
+    def _nearby_moves(self, nearby_length):
+        """Return (counts, moves, cells) for nearby_length, building them on first use.
 
-    def _is_nearby_empty(self, nearby_length, row, col):
-        for r in range(row-nearby_length, row+nearby_length+1):
-            for c in range(col-nearby_length, col+nearby_length+1):
-                if r < 0 or c < 0 or r >= 15 or c >= 15:
-                    continue
-                if self._board[r][c] is not '.':
-                    return False
-        return True
+        counts[row][col] is the number of stones within nearby_length of (row, col)
+        and moves is the set of empty cells with a nonzero count. Both are kept
+        up to date by put_stone and _remove_stone. cells is the utils.neighbourhood
+        table of the board size.
+        """
+        if nearby_length not in self._nearby:
+            size = self.size
+            cells = neighbourhood(nearby_length, size)
+            counts = [[0] * size for _ in range(size)]
+            for row in range(size):
+                for col in range(size):
+                    if self._board[row][col] != '.':
+                        for r, c in cells[row][col]:
+                            counts[r][c] += 1
+            moves = {(r, c) for r in range(size) for c in range(size) if counts[r][c] and self._board[r][c] == '.'}
+            self._nearby[nearby_length] = (counts, moves, cells)
+        return self._nearby[nearby_length]
 
     def enumerate_next_board(self):
         """Enumerate all possible next board.
@@ -146,47 +289,65 @@ class Board:
         """
         nb = []
         for move in self.get_legal_moves():
-            next_board = Board(self)
-            next_board.put_stone(move)
-            nb.append((move, next_board.board))
+            self.push(move)
+            nb.append((move, self.board))
+            self.pop()
         return nb
 
     def get_state(self):
         """Return board state. 0: none, 1: black, 2: white, 3: board full"""
-        for row in range(15):
-            for col in range(15):
+        return self._state
+
+    def _is_five_at(self, pos):
+        """Check if there are win_length stones in a row on the lines through pos."""
+        row, col = pos
+        five = self._board[row][col] * self.win_length
+        for line in self._lines_at(pos):
+            if five in line:
+                return True
+        return False
+
+    def is_five_point(self, pos, color):
+        """Check if a stone of color on the empty cell pos would make win_length in a row."""
+        five = color * self.win_length
+        for line, offset in zip(*self.lines_through(pos)):
+            if five in line[:offset] + color + line[offset + 1:]:
+                return True
+        return False
+
+    def _scan_state(self):
+        """Compute the board state by scanning the whole board."""
+        size = self.size
+        for row in range(size):
+            for col in range(size):
                 for color in ['b', 'w']:
                     if self._board[row][col] == color:
                         win_flag = [1, 1, 1, 1]
-                        for i in range(1, 5):
-                            if row + i >= 15 or self._board[row + i][col] != color:
+                        for i in range(1, self.win_length):
+                            if row + i >= size or self._board[row + i][col] != color:
                                 win_flag[0] = 0
-                            if col + i >= 15 or self._board[row][col + i] != color:
+                            if col + i >= size or self._board[row][col + i] != color:
                                 win_flag[1] = 0
-                            if row + i >= 15 or col + i >= 15 or self._board[row + i][col + i] != color:
+                            if row + i >= size or col + i >= size or self._board[row + i][col + i] != color:
                                 win_flag[2] = 0
-                            if row + i >= 15 or col - i < 0 or self._board[row + i][col - i] != color:
+                            if row + i >= size or col - i < 0 or self._board[row + i][col - i] != color:
                                 win_flag[3] = 0
                         if any(win_flag):
                             return ['b', 'w'].index(color) + 1
-        return 3 if not self.get_legal_moves() else 0
+        return 3 if self._num_stone == size * size else 0
+
+    def _lines_at(self, pos):
+        """Return the four lines (-, |, \\, /) passing through pos as strings."""
+        return [self._lines[line_id] for line_id, _ in self._cell_lines[pos[0]][pos[1]]]
+
+    def lines_through(self, pos):
+        """Return the four lines through pos (see utils.CELL_LINES) and the offset of pos in each."""
+        return self._lines_at(pos), [offset for _, offset in self._cell_lines[pos[0]][pos[1]]]
 
     def _get_occurrence_at(self, pos):
-        x, y = pos
-        occurrence = [0] * len(self._patterns)
-
-        lines = [''.join(self._board[x]),
-                 ''.join(list(zip(*self._board))[y]),
-                 ''.join(diagonal_line(self._board, x, y, '\\')),
-                 ''.join(diagonal_line(self._board, x, y, '/'))]
-
-        for i, p in enumerate(self._patterns):
-            for line in lines:
-                _p = p.replace('.', '\.')
-                occurrence[i] += len(re.findall(r'(?=(%s))' % _p, line))
-                if p != p[::-1]:
-                    occurrence[i] += len(re.findall(r'(?=(%s))' % _p, line[::-1]))
-        return occurrence
+        """Return the pattern occurrence in the windows covering pos."""
+        offsets = [offset for _, offset in self._cell_lines[pos[0]][pos[1]]]
+        return self._matcher.count_at(self._lines_at(pos), offsets)
 
     def get_features(self):
         feature = []
@@ -222,6 +383,33 @@ class Board:
                     feature += [0, 1]
         return feature
 
+
+def game_transitions(moves, patterns, size=15, win_length=5):
+    """Replay moves on a new board and yield (features, reward, next_features) for every move.
+
+    The reward is 1 or -1 for a move that wins for black or white, and otherwise the shaped reward
+    ReinforceAIPlayer learns from.
+
+    :param size: Size of the board the game was played on.
+    :param win_length: Number of stones in a row that won the game.
+    """
+    board = Board(patterns=patterns, size=size, win_length=win_length)
+    features = board.get_features()
+    for move in moves:
+        occurrence = board.occurrence
+        board.put_stone(move)
+        next_features = board.get_features()
+        state = board.get_state()
+        if state == 1:
+            reward = 1.
+        elif state == 2:
+            reward = -1.
+        else:
+            reward = shaped_reward(occurrence, board.occurrence, config.reward_weights)
+        yield features, reward, next_features
+        features = next_features
+
+
 if __name__ == '__main__':
     from utils import extract_features, file_to_patterns, str_to_board
     import random
@@ -232,3 +420,47 @@ if __name__ == '__main__':
     print(b.get_features())
     print(extract_features(b.board, file_to_patterns('pattern.txt')))
     assert b.get_features() == extract_features(b.board, file_to_patterns('pattern.txt'))
+
+    # per-candidate cost of trying a move on a copy and with push/pop
+    import time
+    moves = b.get_legal_moves()
+    start = time.time()
+    for move in moves:
+        next_board = b.copy()
+        next_board.put_stone(move)
+        next_board.get_state()
+    copy_time = (time.time() - start) / len(moves)
+    start = time.time()
+    for move in moves:
+        b.push(move)
+        b.get_state()
+        b.pop()
+    push_time = (time.time() - start) / len(moves)
+    print('per candidate: copy + put_stone %.1f us, push/pop %.1f us' % (copy_time * 1e6, push_time * 1e6))
+
+    # per-ply cost of the game loop itself, random vs random with and without an observer
+    class RandomPlayer:
+        def __init__(self, stone_color):
+            self.stone_color = stone_color
+
+        def think(self, game):
+            return random.choice(game.board.get_legal_nearby_moves(1) or [(7, 7)])
+
+        def on_game_over(self, game):
+            pass
+
+    import contextlib
+    import io
+    for observers in [[], [lambda event: None]]:
+        plies = 0
+        elapsed = 0.
+        for _ in range(50):
+            game = GomokuGame(RandomPlayer, RandomPlayer)
+            for observer in observers:
+                game.add_observer(observer)
+            start = time.time()
+            with contextlib.redirect_stdout(io.StringIO()):
+                game.start()
+            elapsed += time.time() - start
+            plies += game.moves
+        print('%d observers: %.1f us per ply' % (len(observers), elapsed / plies * 1e6))
@@ -0,0 +1,193 @@
+# Compact binary game records: a small header and one byte per move, appended to shard files.
+import glob
+import os
+import struct
+
+import config
+from game import BoardUpdateEvent, GameOverEvent, MoveEvent, game_transitions
+
+# marker, final state (1: black won, 2: white won, 3: draw), number of moves
+HEADER = struct.Struct('<BBH')
+# games on the standard 15 x 15 board with five in a row
+MARKER = 0x47
+# games on other boards, whose header is followed by SIZES
+SIZED_MARKER = 0x48
+# board size, win length
+SIZES = struct.Struct('<BB')
+STATES = {'b': 1, 'w': 2, None: 3}
+
+
+def encode(moves, state, size=15, win_length=5):
+    """Return the record of a game as bytes.
+
+    A move (row, col) is stored as row * size + col, in one byte, or in two
+    bytes on boards of more than 256 cells.
+    """
+    cells = [row * size + col for row, col in moves]
+    if size == 15 and win_length == 5:
+        return HEADER.pack(MARKER, state, len(moves)) + bytes(cells)
+    header = HEADER.pack(SIZED_MARKER, state, len(moves)) + SIZES.pack(size, win_length)
+    if size * size <= 256:
+        return header + bytes(cells)
+    return header + struct.pack('<%dH' % len(cells), *cells)
+
+
+def _decode_moves(data, size):
+    if size * size <= 256:
+        cells = data
+    else:
+        cells = struct.unpack('<%dH' % (len(data) // 2), data)
+    return [divmod(n, size) for n in cells]
+
+
+class GameRecordWriter:
+    """Append finished games to shard files in directory.
+
+    An instance can be given to GomokuGame.add_observer, or games can
+    be written directly with write. Every process writes its own shards,
+    named <prefix>-<pid>-<n>.rec, and starts a new one after games_per_shard
+    games. The board size and win length of an observed game are read off
+    its board; size and win_length, if given, are recorded instead, and
+    games written directly default to the ones in config.
+    """
+    def __init__(self, directory=config.record_dir, games_per_shard=10000, prefix='games', size=None,
+                 win_length=None):
+        self.directory = directory
+        self.games_per_shard = games_per_shard
+        self.prefix = prefix
+        self.size = size
+        self.win_length = win_length
+        self.games = 0
+        self._moves = []
+        # board of the game observed, from its first event carrying one
+        self._board = None
+        os.makedirs(directory, exist_ok=True)
+
+    def __call__(self, event):
+        if isinstance(event, MoveEvent):
+            self._moves.append(event.move)
+        elif isinstance(event, BoardUpdateEvent):
+            if self._board is None:
+                self._board = event.board
+        elif isinstance(event, GameOverEvent):
+            board = self._board or event.board
+            if board is None:
+                self.write(self._moves, STATES[event.winner])
+            else:
+                self.write(self._moves, STATES[event.winner], board.size, board.win_length)
+            self._moves = []
+            self._board = None
+
+    @property
+    def path(self):
+        """The shard the next game goes to."""
+        return os.path.join(self.directory, '%s-%d-%05d.rec' % (
+            self.prefix, os.getpid(), self.games // self.games_per_shard))
+
+    def write(self, moves, state, size=config.board_size, win_length=config.win_length):
+        """Append a game played on a size x size board, unless the writer was given its own size and win_length."""
+        size = self.size or size
+        win_length = self.win_length or win_length
+        # one write per game with the file opened for appending, so a game is never split
+        with open(self.path, 'ab') as f:
+            f.write(encode(moves, state, size, win_length))
+        self.games += 1
+
+
+def record_files(paths):
+    """Return the shard files in paths, a directory, a glob pattern or a list of them."""
+    if isinstance(paths, str):
+        paths = [paths]
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(glob.glob(os.path.join(path, '*.rec')))
+        else:
+            files += sorted(glob.glob(path))
+    return files
+
+
+def read_records(paths):
+    """Yield (moves, state, size, win_length) for every game in the shard files, reading one game at a time."""
+    for path in record_files(paths):
+        with open(path, 'rb') as f:
+            while True:
+                header = f.read(HEADER.size)
+                if not header:
+                    break
+                if len(header) < HEADER.size:
+                    raise Exception('Truncated game record in %s' % path)
+                marker, state, length = HEADER.unpack(header)
+                if marker == MARKER:
+                    size, win_length = 15, 5
+                elif marker == SIZED_MARKER:
+                    sizes = f.read(SIZES.size)
+                    if len(sizes) < SIZES.size:
+                        raise Exception('Truncated game record in %s' % path)
+                    size, win_length = SIZES.unpack(sizes)
+                else:
+                    raise Exception('Broken game record in %s' % path)
+                nbytes = length if size * size <= 256 else 2 * length
+                data = f.read(nbytes)
+                if len(data) != nbytes:
+                    raise Exception('Broken game record in %s' % path)
+                yield _decode_moves(data, size), state, size, win_length
+
+
+def read_transitions(paths, patterns):
+    """Yield (features, reward, next_features) for every move of every game in the shard files."""
+    for moves, state, size, win_length in read_records(paths):
+        for transition in game_transitions(moves, patterns, size, win_length):
+            yield transition
+
+
+if __name__ == '__main__':
+    import random
+    import tempfile
+    import time
+    from game import Board
+    from utils import file_to_patterns
+
+    directory = tempfile.mkdtemp()
+    writer = GameRecordWriter(directory, games_per_shard=50)
+    games = []
+    for _ in range(120):
+        board = Board()
+        moves = []
+        while board.get_state() == 0:
+            moves.append(random.choice(board.get_legal_nearby_moves(1) or [(7, 7)]))
+            board.put_stone(moves[-1])
+        games.append((moves, board.get_state(), 15, 5))
+        writer.write(*games[-1][:2])
+    print(record_files(directory))
+    assert list(read_records(directory)) == games
+
+    # other boards go to their own shards
+    other_games = []
+    for size, win_length in [(9, 4), (19, 5)]:
+        other = GameRecordWriter(directory, prefix='games-%d' % size, size=size, win_length=win_length)
+        board = Board(size=size, win_length=win_length)
+        moves = []
+        while board.get_state() == 0:
+            moves.append(random.choice(board.get_legal_nearby_moves(1) or [board.center]))
+            board.put_stone(moves[-1])
+        other_games.append((moves, board.get_state(), size, win_length))
+        other.write(moves, board.get_state())
+        assert list(read_records(other.path)) == other_games[-1:]
+
+    # an observer records the size and win length of the game's board
+    observer = GameRecordWriter(directory, prefix='observed')
+    board = Board(size=9, win_length=4)
+    moves = [(4, 4), (0, 0), (4, 5), (0, 1), (4, 6), (0, 2), (4, 7)]
+    for move in moves:
+        observer(MoveEvent('bw'[board.num_stone % 2], move))
+        board.put_stone(move)
+        observer(BoardUpdateEvent(board))
+    observer(GameOverEvent('b', board))
+    assert list(read_records(observer.path)) == [(moves, 1, 9, 4)]
+    print('%.1f bytes per move' % (sum(os.path.getsize(f) for f in record_files(directory)) /
+                                   float(sum(len(game[0]) for game in games))))
+
+    start = time.time()
+    n = sum(1 for _ in read_transitions(directory, file_to_patterns(config.pattern_file_name)))
+    print('%d transitions, %.0f transitions/sec' % (n, n / (time.time() - start)))
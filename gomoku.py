@@ -1,19 +1,25 @@
+from collections import deque
 from threading import Thread
 import time
 
 import kivy
 from kivy.app import App
-from kivy.clock import mainthread
+from kivy.clock import Clock
 from kivy.graphics import Color, Line
 from kivy.uix.floatlayout import FloatLayout
 from kivy.uix.gridlayout import GridLayout
 from kivy.uix.image import Image
 from kivy.uix.label import Label
 
-from game import GomokuGame, BoardUpdateEvent, GameOverEvent, MoveEvent
+from batch_features import BatchFeatureExtractor
+from game import GomokuGame, BoardUpdateEvent, GameOverEvent, MoveEvent, ProgressEvent
+from heatmap import HeatmapWorker, ValueHeatmap
 from player import GuiPlayer, RandomAIPlayer, ReinforceAIPlayer, GuiTestPlayer, ReinforceRandomPlayer
-from rl_network.critic_network import CriticNN
-from utils import file_to_patterns, extract_features
+import config
+from rl_network.eval_cache import EvaluationCache
+from rl_network.numpy_critic import NumpyCriticNN
+from think_executor import ThinkExecutor
+from utils import file_to_patterns
 
 kivy.require('1.9.1')
 
@@ -36,10 +42,14 @@ class BoardGrid(GridLayout):
     def __init__(self, **kwargs):
         super(BoardGrid, self).__init__(**kwargs)
         self.size_hint = (None, None)
-        self.rows = self.cols = 15
+        self.rows = self.cols = config.board_size
         self.last_stone = None
-        for row in range(15):
-            for col in range(15):
+        self.candidate_stone = None
+        # value overlay, created on first use, and the label changes it computed
+        self._heatmap = None
+        self._labels = deque()
+        for row in range(self.rows):
+            for col in range(self.cols):
                 self.add_widget(Stone((row, col)))
 
     def on_size(self, instance, val):
@@ -48,34 +58,46 @@ class BoardGrid(GridLayout):
     def on_pos(self, instance, val):
         self.draw_grid()
 
-    @mainthread
     def update_stone(self, event):
-        n = event.move[0] * 15 + event.move[1]
-        # The children seems to be reversed...
-        stone = self.children[224-n]
+        self.show_progress(None)
+        stone = self.stone_at(event.move)
         stone.show_stone(event.stone_color)
         if self.last_stone:
             self.last_stone.remove_dot()
         self.last_stone = stone
 
+    def stone_at(self, move):
+        # The children seems to be reversed...
+        return self.children[len(self.children) - 1 - (move[0] * self.cols + move[1])]
+
+    def show_progress(self, event):
+        """Mark the move a thinking player likes best so far, or clear the mark if event is None."""
+        if self.candidate_stone:
+            self.candidate_stone.show_candidate(False)
+            self.candidate_stone = None
+        if event is not None and event.move is not None:
+            self.candidate_stone = self.stone_at(event.move)
+            self.candidate_stone.show_candidate(True)
+
     def board_value_listener(self, event):
-        return
-        patterns = file_to_patterns('pattern.txt')
-        feature = extract_features(event.board.board, patterns)
-        cnn = CriticNN(len(feature))
-        children = []
-        features = []
-        for pos, next_board in event.board.enumerate_next_board():
-            n = pos[0] * 15 + pos[1]
-            stone = self.children[224-n]
-            if stone.has_stone():
-                continue
-            else:
-                children.append(stone)
-                feature = extract_features(next_board, patterns)
-                features.append(feature)
-        for child, v in zip(children, cnn.run_value(features)):
-            child.show_value(v[0])
+        """Start computing the value overlay of the board of event on the heatmap thread.
+
+        Called on the game thread, right after the board changed, so the board can be copied safely.
+        """
+        if not config.value_overlay:
+            return
+        if self._heatmap is None:
+            patterns = file_to_patterns(config.pattern_file_name)
+            critic = EvaluationCache(NumpyCriticNN(BatchFeatureExtractor(patterns).num_features),
+                                     config.eval_cache_size)
+            self._heatmap = HeatmapWorker(ValueHeatmap(critic, patterns, config.win_length), self._labels.append)
+        self._heatmap.submit(event.board.board)
+
+    def show_values(self):
+        """Show the labels the overlay changed since the last call."""
+        while self._labels:
+            for (row, col), label in self._labels.popleft().items():
+                self.stone_at((row, col)).show_value(label)
 
     def draw_grid(self):
         self.canvas.before.clear()
@@ -86,7 +108,7 @@ class BoardGrid(GridLayout):
 
             # draw white lines
             Color(1, 1, 1, .8)
-            for i in range(15):
+            for i in range(self.rows):
                 x0, y0 = self.x + padding_x, self.y + padding_y + i * delta + 1
                 x1, y1 = self.x + self.width - padding_x, self.y + padding_y + i * delta + 1
                 Line(points=[x0, y0, x1, y1], width=1)
@@ -97,7 +119,7 @@ class BoardGrid(GridLayout):
 
             # draw black lines
             Color(0, 0, 0, 1)
-            for i in range(15):
+            for i in range(self.rows):
                 x0, y0 = self.x + padding_x, self.y + padding_y + i * delta
                 x1, y1 = self.x + self.width - padding_x, self.y + padding_y + i * delta
                 Line(points=[x0, y0, x1, y1], width=2)
@@ -106,7 +128,10 @@ class BoardGrid(GridLayout):
                 x1, y1 = self.x + padding_x + i * delta, self.y + self.height - padding_y
                 Line(points=[x0, y0, x1, y1], width=2)
 
-            dot = [(3, 3), (11, 3), (7, 7), (3, 11), (11, 11)]
+            # star points, 3 cells in from the edges (2 on small boards) and the center
+            edge = 3 if self.rows >= 13 else 2
+            far, center = self.rows - 1 - edge, self.rows // 2
+            dot = [(edge, edge), (far, edge), (center, center), (edge, far), (far, far)]
             for x, y in dot:
                 x = self.x + x * delta + padding_x
                 y = self.y + y * delta + padding_y
@@ -120,7 +145,10 @@ class Stone(FloatLayout):
         self.stone_img = Image(size_hint=(.9, .9),
                                pos_hint={'center_x': 0.5, 'center_y': 0.5})
         self.label = Label(pos_hint={'center_x': 0.5, 'center_y': 0.5})
+        # whether a thinking player currently likes this move best
+        self.candidate = False
         self.bind(on_touch_up=self.click)
+        self.bind(pos=self.draw_candidate, size=self.draw_candidate)
         self.add_widget(self.label)
 
     def click(self, instance, touch):
@@ -148,6 +176,19 @@ class Stone(FloatLayout):
     def show_value(self, value):
         self.label.text = str(value)
 
+    def show_candidate(self, candidate):
+        """Circle this cell while a player considers this move."""
+        self.candidate = candidate
+        self.draw_candidate()
+
+    def draw_candidate(self, *args):
+        # drawn over the stone and the label, so it shows on empty and occupied cells alike
+        self.canvas.after.clear()
+        if self.candidate:
+            with self.canvas.after:
+                Color(1, .2, .2, 1)
+                Line(width=2, circle=(self.center_x, self.center_y, min(self.width, self.height) * .4))
+
     def remove_value(self):
         self.remove_widget(self.label)
 
@@ -156,26 +197,52 @@ class GomokuApp(App):
     def __init__(self, **kwargs):
         super(GomokuApp, self).__init__(**kwargs)
         self.layout = BoardLayout()
-        # self.game = GomokuGame(GuiPlayer, GuiPlayer)
-        # self.game = GomokuGame(GuiTestPlayer, GuiTestPlayer)
-        self.game = GomokuGame(ReinforceAIPlayer, ReinforceAIPlayer)
-        # self.game = GomokuGame(RandomAIPlayer, RandomAIPlayer)
+        self.executor = ThinkExecutor()
+        # self.game = GomokuGame(GuiPlayer, GuiPlayer, executor=self.executor)
+        # self.game = GomokuGame(GuiTestPlayer, GuiTestPlayer, executor=self.executor)
+        self.game = GomokuGame(ReinforceAIPlayer, ReinforceAIPlayer, executor=self.executor)
+        # self.game = GomokuGame(RandomAIPlayer, RandomAIPlayer, executor=self.executor)
+        # events from the game thread, applied once per frame by apply_events
+        self._events = deque()
 
     def build(self):
         self.game.set_event_callback(self.callback)
         return self.layout
 
     def on_start(self):
+        Clock.schedule_interval(self.apply_events, 1 / 30.)
         Thread(target=self.game.start, daemon=True).start()
 
-    @mainthread
+    def on_stop(self):
+        self.executor.shutdown()
+
     def callback(self, event):
-        if isinstance(event, MoveEvent):
-            self.layout.board_grid.update_stone(event)
-        elif isinstance(event, BoardUpdateEvent):
+        # called on the game thread; the UI is only touched in apply_events
+        if isinstance(event, BoardUpdateEvent):
             self.layout.board_grid.board_value_listener(event)
-        elif isinstance(event, GameOverEvent):
-            self.stop()
+        else:
+            self._events.append(event)
+
+    def apply_events(self, dt):
+        """Apply the events and value labels received since the last frame.
+
+        Every move is shown, but only the last progress event of the frame
+        is, so a fast search cannot flood the UI.
+        """
+        progress = None
+        while self._events:
+            event = self._events.popleft()
+            if isinstance(event, MoveEvent):
+                self.layout.board_grid.update_stone(event)
+                progress = None
+            elif isinstance(event, ProgressEvent):
+                progress = event
+            elif isinstance(event, GameOverEvent):
+                self.stop()
+                return
+        self.layout.board_grid.show_values()
+        if progress is not None:
+            self.layout.board_grid.show_progress(progress)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,143 @@
+# Critic values of every next move, for the value overlay of the GUI.
+import threading
+
+import numpy as np
+
+from batch_features import BatchFeatureExtractor
+from game import Board
+from utils import line_tables
+
+
+class ValueHeatmap:
+    """Value of the position after each empty cell is played, kept from move to move.
+
+    The occurrence change a stone makes on a cell only depends on the lines
+    through the cell, so it is kept for every cell and color and recomputed
+    only for cells that share a line with a new stone, within a pattern
+    length of it. The values themselves come from one critic call per
+    update, and update returns only the labels that changed.
+
+    :param critic: Object with run_value, such as an EvaluationCache of a NumpyCriticNN.
+    :param win_length: Number of stones in a row that win, as on the boards given to update.
+    """
+    def __init__(self, critic, patterns, win_length=5):
+        self.critic = critic
+        self._patterns = patterns
+        self._win_length = win_length
+        self._size = None
+        self._extractor = BatchFeatureExtractor(patterns)
+        self._reach = max(len(p) for p in patterns) - 1
+        self._stones = {}
+        # color -> {move: occurrence change of putting a stone of that color on move}
+        self._deltas = {'b': {}, 'w': {}}
+        self._labels = {}
+
+    def update(self, board):
+        """Return {move: label} for the cells whose label changed, '' for cells that got a stone.
+
+        :param board: Board in list representation.
+        """
+        stones = {(r, c): stone for r, row in enumerate(board) for c, stone in enumerate(row) if stone != '.'}
+        if len(board) != self._size or any(stones.get(pos) != stone for pos, stone in self._stones.items()):
+            # stones were taken back or a new game started
+            self._size = len(board)
+            self._deltas = {'b': {}, 'w': {}}
+        else:
+            for pos in stones.keys() - self._stones.keys():
+                self._invalidate(pos)
+        self._stones = stones
+
+        b = Board(board, patterns=self._patterns, win_length=self._win_length)
+        color = b.get_next_stone_color()
+        deltas = self._deltas[color]
+        moves = b.get_legal_moves()
+        labels = {}
+        if moves and b.get_state() == 0:
+            for move in moves:
+                if move not in deltas:
+                    deltas[move] = b.push(move)
+                    b.pop()
+            occurrence = np.asarray(b.occurrence) + np.asarray([deltas[move] for move in moves])
+            # after the move, the other color is to move
+            black_to_move = np.full(len(moves), color == 'w')
+            values = self.critic.run_value(self._extractor.features_from_occurrence(occurrence, black_to_move))
+            labels = {move: '%.2f' % value for move, value in zip(moves, values[:, 0])}
+
+        changed = {move: label for move, label in labels.items() if self._labels.get(move) != label}
+        changed.update((move, '') for move in self._labels if move not in labels)
+        self._labels = labels
+        return changed
+
+    def _invalidate(self, pos):
+        lines, cell_lines = line_tables(self._size)
+        for line_id, offset in cell_lines[pos[0]][pos[1]]:
+            line = lines[line_id]
+            for cell in line[max(0, offset - self._reach):offset + self._reach + 1]:
+                for deltas in self._deltas.values():
+                    deltas.pop(cell, None)
+
+
+class HeatmapWorker:
+    """Update a ValueHeatmap on its own thread.
+
+    submit only keeps the latest board, so a worker that falls behind skips
+    to the newest position. on_labels is called on the worker thread with
+    the changed labels of every update.
+    """
+    def __init__(self, heatmap, on_labels):
+        self.heatmap = heatmap
+        self.on_labels = on_labels
+        self._board = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, board):
+        """Ask for the labels of board, in list representation. The caller must not modify it afterwards."""
+        with self._lock:
+            self._board = board
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            with self._lock:
+                board, self._board = self._board, None
+            if board is not None:
+                self.on_labels(self.heatmap.update(board))
+
+
+if __name__ == '__main__':
+    import random
+    import time
+    import config
+    from batch_features import boards_to_array, extract_features_batch, next_boards_array
+    from rl_network.numpy_critic import NumpyCriticNN
+    from utils import file_to_patterns
+
+    patterns = file_to_patterns(config.pattern_file_name)
+    critic = NumpyCriticNN(BatchFeatureExtractor(patterns).num_features)
+    critic._W1 = np.random.randn(*critic._W1.shape).astype(np.float32)
+    critic._W2 = np.random.randn(*critic._W2.shape).astype(np.float32)
+    heatmap = ValueHeatmap(critic, patterns)
+    board = Board(patterns=patterns)
+    shown = {}
+    full = incremental = 0.
+    for _ in range(60):
+        board.put_stone(random.choice(board.get_legal_nearby_moves(1) or [(7, 7)]))
+        if board.get_state():
+            break
+        start = time.time()
+        shown.update(heatmap.update(board.board))
+        incremental += time.time() - start
+
+        # the labels must match the values of the next boards computed from scratch
+        start = time.time()
+        moves = board.get_legal_moves()
+        next_boards = next_boards_array(boards_to_array([board.board])[0], moves, board.get_next_stone_color())
+        values = critic.run_value(extract_features_batch(next_boards, patterns))
+        full += time.time() - start
+        assert {m: l for m, l in shown.items() if l} == {m: '%.2f' % v for m, v in zip(moves, values[:, 0])}
+    print('heatmap update %.1f ms, from scratch %.1f ms' % (incremental * 1000 / (_ + 1), full * 1000 / (_ + 1)))
@@ -9,12 +9,13 @@ class Pattern:
 
     def update_pattern_num(self, board):
         self.pattern_num = [0] * len(self.pattern)
-        for row in range(15):
-            for col in range(15):
+        size = len(board)
+        for row in range(size):
+            for col in range(size):
                 for length in range(len(self.pattern_num)):
                     is_add = True
                     for index in range(7):
-                        if col + index < 15:
+                        if col + index < size:
                             if self.pattern[length][index] != '.' and board[row][col + index] != self.pattern[length][index]:
                                 is_add = False
                             #A black white threshhold
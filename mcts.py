@@ -0,0 +1,134 @@
+# Monte Carlo tree search driven by the critic network.
+import math
+import time
+
+
+class Node:
+    """A position in the search tree.
+
+    value_sum is seen from the player who made the move leading to this node.
+    """
+    __slots__ = ('children', 'visits', 'value_sum', 'terminal')
+
+    def __init__(self):
+        # move -> Node, set when the node is expanded
+        self.children = None
+        self.visits = 0
+        self.value_sum = 0.
+        # value of a finished game for the player who moved into this node
+        self.terminal = None
+
+
+class MCTS:
+    """UCT search that evaluates leaves with a critic in batches.
+
+    Each batch selects up to batch_size leaves. Nodes on a selected path get
+    virtual_loss extra visits without value until the batch is evaluated, so
+    the following selections of the batch spread to other leaves. All leaves
+    of a batch are evaluated with one critic.run_value call. The critic gives
+    the value of a position for black, between 0 and 1.
+    """
+    def __init__(self, critic, batch_size=16, exploration=1.4, virtual_loss=1, nearby_length=2):
+        self.critic = critic
+        self.batch_size = batch_size
+        self.exploration = exploration
+        self.virtual_loss = virtual_loss
+        self.nearby_length = nearby_length
+        self.root = Node()
+
+    def reset(self):
+        self.root = Node()
+
+    def advance(self, move):
+        """Make the child reached by move the new root, keeping its subtree."""
+        child = self.root.children.get(move) if self.root.children else None
+        self.root = child or Node()
+
+    def best_move(self):
+        """Return the most visited move from the root, or None if the root is not expanded."""
+        if not self.root.children:
+            return None
+        return max(self.root.children.items(), key=lambda item: item[1].visits)[0]
+
+    def search(self, board, simulations=800, time_limit=None, stop=None, progress=None):
+        """Run up to simulations simulations from board, which must be the root position.
+
+        The board is searched with push/pop and left as it was. Return the number of simulations run.
+
+        :param stop: threading.Event that ends the search after the current batch when set.
+        :param progress: Function called with the number of simulations run after every batch.
+        """
+        deadline = time.time() + time_limit if time_limit else None
+        done = 0
+        while (done < simulations and (deadline is None or time.time() < deadline) and
+               (stop is None or not stop.is_set())):
+            done += self._run_batch(board, min(self.batch_size, simulations - done))
+            if progress is not None:
+                progress(done)
+        return done
+
+    def _select(self, node):
+        log_visits = math.log(max(node.visits, 1))
+        best_score, best = -1., None
+        for move, child in node.children.items():
+            if child.visits == 0:
+                return move, child
+            score = child.value_sum / child.visits + self.exploration * math.sqrt(log_visits / child.visits)
+            if score > best_score:
+                best_score, best = score, (move, child)
+        return best
+
+    def _backup(self, path, value):
+        """Add value, seen from the player who moved into the last node of path, along path."""
+        for node in reversed(path):
+            node.visits += 1 - self.virtual_loss
+            node.value_sum += value
+            value = 1. - value
+
+    def _run_batch(self, board, n):
+        pending = set()
+        leaves = []
+        features = []
+        done = 0
+        for _ in range(n):
+            node = self.root
+            path = [node]
+            while node.children and node not in pending:
+                move, node = self._select(node)
+                board.push(move)
+                path.append(node)
+            for visited in path:
+                visited.visits += self.virtual_loss
+
+            if node.terminal is None and node.children is None:
+                state = board.get_state()
+                if state in [1, 2]:
+                    node.terminal = 1.
+                elif state == 3:
+                    node.terminal = .5
+
+            if node.terminal is not None:
+                self._backup(path, node.terminal)
+                done += 1
+            elif node in pending:
+                # another simulation of this batch is already evaluating this leaf
+                for visited in path:
+                    visited.visits -= self.virtual_loss
+            else:
+                moves = board.get_legal_nearby_moves(self.nearby_length) or board.get_legal_moves()
+                node.children = {move: Node() for move in moves}
+                pending.add(node)
+                # the player who moved into the leaf is black if white is to move
+                leaves.append((path, board.num_stone % 2 == 1))
+                features.append(board.get_features())
+                done += 1
+
+            for _ in range(len(path) - 1):
+                board.pop()
+
+        if features:
+            values = self.critic.run_value(features)
+            for (path, black_moved), value in zip(leaves, values):
+                value = float(value[0])
+                self._backup(path, value if black_moved else 1. - value)
+        return max(done, 1)
@@ -0,0 +1,187 @@
+# Opening book: move statistics of recorded games in a memory-mapped hash table.
+import mmap
+import os
+import struct
+
+import config
+from utils import ZOBRIST
+
+
+def _build_symmetries():
+    """Return, for each of the 8 symmetries of the board, a table of where (row, col) goes as [row][col]."""
+    transforms = [
+        lambda r, c: (r, c),
+        lambda r, c: (c, 14 - r),
+        lambda r, c: (14 - r, 14 - c),
+        lambda r, c: (14 - c, r),
+        lambda r, c: (r, 14 - c),
+        lambda r, c: (c, r),
+        lambda r, c: (14 - r, c),
+        lambda r, c: (14 - c, 14 - r),
+    ]
+    return [[[f(r, c) for c in range(15)] for r in range(15)] for f in transforms]
+
+# SYMMETRIES[s][row][col] is the image of (row, col) under symmetry s, and
+# INVERSE[s] is the symmetry taking it back.
+SYMMETRIES = _build_symmetries()
+INVERSE = [next(t for t in range(8) if all(SYMMETRIES[t][r2][c2] == (r, c) for r, row in enumerate(SYMMETRIES[s])
+                                           for c, (r2, c2) in enumerate(row)))
+           for s in range(8)]
+
+
+def canonical_key(board):
+    """Return (key, symmetries) for a board in list representation.
+
+    key is the smallest Zobrist hash of the board under the 8 symmetries, so
+    symmetric positions share a key, and symmetries are the ones giving it.
+    """
+    hashes = [0] * 8
+    for r, row in enumerate(board):
+        for c, stone in enumerate(row):
+            if stone != '.':
+                keys = ZOBRIST[stone]
+                for s in range(8):
+                    sr, sc = SYMMETRIES[s][r][c]
+                    hashes[s] ^= keys[sr][sc]
+    key = min(hashes)
+    return key, [s for s in range(8) if hashes[s] == key]
+
+
+MAGIC = b'GOMOBOOK'
+# magic, version, number of slots, number of entries, plies covered
+HEADER = struct.Struct('<8sIIII')
+# position key, move as row * 15 + col, visits, score in half points for the player to move
+ENTRY = struct.Struct('<QHxxII')
+VERSION = 1
+
+
+def build_book(records, path=config.opening_book_file, max_plies=config.opening_book_plies):
+    """Write an opening book from recorded games.
+
+    :param records: Iterable of (moves, state), state being 1 if black won, 2 if white won and 3 for a draw.
+    :param max_plies: Number of plies from the start of every game to record.
+    :return: Number of (position, move) entries written.
+    """
+    stats = {}
+    for moves, state in records:
+        board = [['.'] * 15 for _ in range(15)]
+        for ply, (row, col) in enumerate(moves[:max_plies]):
+            color = 'bw'[ply % 2]
+            key, symmetries = canonical_key(board)
+            # a position symmetric in itself maps equivalent moves to the same one
+            r, c = min(SYMMETRIES[s][row][col] for s in symmetries)
+            entry = stats.setdefault((key, r * 15 + c), [0, 0])
+            entry[0] += 1
+            entry[1] += 2 if state == ply % 2 + 1 else 1 if state == 3 else 0
+            board[row][col] = color
+
+    # keep the load factor at or below one half, so that probes stay short
+    slots = 1 << max(2 * len(stats) - 1, 1).bit_length()
+    mask = slots - 1
+    table = bytearray(HEADER.size + ENTRY.size * slots)
+    HEADER.pack_into(table, 0, MAGIC, VERSION, slots, len(stats), max_plies)
+    # entries of one position are inserted together, so they sit in one probe run
+    for (key, move), (visits, score) in sorted(stats.items()):
+        index = key & mask
+        while ENTRY.unpack_from(table, HEADER.size + ENTRY.size * index)[2]:
+            index = (index + 1) & mask
+        ENTRY.pack_into(table, HEADER.size + ENTRY.size * index, key, move, visits, score)
+
+    tmp_path = '%s.tmp-%d' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(table)
+    os.replace(tmp_path, path)
+    return len(stats)
+
+
+class OpeningBook:
+    """Read-only view of a book written by build_book.
+
+    The file is memory-mapped, so processes opening the same book share its pages.
+    """
+    def __init__(self, path=config.opening_book_file):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.slots, self.entries, self.max_plies = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise Exception('%s is not an opening book' % path)
+        self._mask = self.slots - 1
+
+    def close(self):
+        self._map.close()
+
+    def lookup(self, board):
+        """Return [(move, visits, win_rate)] recorded for the position of a Board.
+
+        Moves are given on the board as it is, whatever symmetry they were recorded in.
+        win_rate counts a draw as half a win for the player to move.
+        """
+        # books are built from games on the standard board
+        if board.num_stone >= self.max_plies or board.size != 15:
+            return []
+        key, symmetries = canonical_key(board.board)
+        back = SYMMETRIES[INVERSE[symmetries[0]]]
+        moves = []
+        index = key & self._mask
+        while True:
+            entry_key, move, visits, score = ENTRY.unpack_from(self._map, HEADER.size + ENTRY.size * index)
+            if not visits:
+                return moves
+            if entry_key == key:
+                moves.append((back[move // 15][move % 15], visits, score / (2. * visits)))
+            index = (index + 1) & self._mask
+
+    def best_move(self, board, min_visits=config.opening_book_min_visits):
+        """Return the move with the best win rate among those played at least min_visits times, or None."""
+        moves = [m for m in self.lookup(board) if m[1] >= min_visits and board.is_legal_move(m[0])]
+        if not moves:
+            return None
+        return max(moves, key=lambda m: (m[2], m[1]))[0]
+
+
+_books = {}
+
+
+def load_book(path=config.opening_book_file):
+    """Return the OpeningBook at path, opened once per process, or None if there is no book."""
+    if path not in _books:
+        _books[path] = OpeningBook(path) if os.path.exists(path) else None
+    return _books[path]
+
+
+if __name__ == '__main__':
+    import random
+    import tempfile
+    import time
+    from game import Board
+
+    # games starting with one of a few openings, in random orientations
+    openings = [[(7, 7), (6, 8), (5, 9)], [(7, 7), (7, 8), (8, 9)]]
+    records = []
+    for _ in range(200):
+        s = random.randrange(8)
+        moves = [SYMMETRIES[s][r][c] for r, c in random.choice(openings)]
+        board = Board()
+        for move in moves:
+            board.put_stone(move)
+        while board.get_state() == 0 and len(moves) < 40:
+            moves.append(random.choice(board.get_legal_nearby_moves(1)))
+            board.put_stone(moves[-1])
+        records.append((moves, board.get_state() or 3))
+
+    path = os.path.join(tempfile.mkdtemp(), 'book.bin')
+    start = time.time()
+    print('%d entries written in %.2f sec' % (build_book(records, path), time.time() - start))
+    book = OpeningBook(path)
+    board = Board()
+    board.put_stone((7, 7))
+    replies = book.lookup(board)
+    print(replies)
+    assert sum(visits for _, visits, _ in replies) == 200
+    # the replies seen in every orientation collapse into the two canonical ones
+    assert len(replies) == 2
+    start = time.time()
+    for _ in range(1000):
+        book.best_move(board)
+    print('%.1f us per lookup' % ((time.time() - start) * 1000))
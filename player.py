@@ -4,23 +4,52 @@ from threading import Event
 
 import utils
 import config
+import batch_features
 import operator
-from game import Board
+from game import Board, ProgressEvent
+from mcts import MCTS
+from opening_book import load_book
+from threat import ThreatSolver
+from transposition import EXACT, LOWER, UPPER, TranspositionTable
 import rl_network.critic_network as cnn
+from rl_network.eval_cache import EvaluationCache
+from rl_network.numpy_critic import NumpyCriticNN
+from rl_network.replay_buffer import ReplayBuffer, ReplayTrainer
 
 
 class GomokuPlayer:
+    # interactive players wait for a person and are not given a deadline by ThinkExecutor
+    interactive = False
+
     def __init__(self, stone_color):
         if stone_color.lower() not in ['w', 'b']:
             raise Exception('stone_color should be "w" or "b"')
         self.stone_color = stone_color.lower()
+        # set by ThinkExecutor while think runs: an Event set when think should return
+        # its best move so far, and a function taking ProgressEvents
+        self.cancel = None
+        self.progress_callback = None
 
     def think(self, game):
         """Return next move."""
         return None
 
+    def is_cancelled(self):
+        return self.cancel is not None and self.cancel.is_set()
+
+    def report_progress(self, move, **info):
+        """Tell the caller of think the best move found so far."""
+        if self.progress_callback is not None:
+            self.progress_callback(ProgressEvent(self.stone_color, move, info))
+
+    def on_game_over(self, game):
+        """Called once the game is over."""
+        pass
+
 
 class GuiPlayer(GomokuPlayer):
+    interactive = True
+
     def __init__(self, *args, **kwargs):
         super(GuiPlayer, self).__init__(*args, **kwargs)
         self._move_event = Event()
@@ -45,23 +74,17 @@ class GuiTestPlayer(GomokuPlayer):
         self._next_move = None
         self._pattern = [0] * config.pattern_num
         self._feature = utils.extract_features(Board().board, config.pattern_file_name)
-        self.CNN = cnn.CriticNN(len(self._feature))
+        self.CNN = EvaluationCache(NumpyCriticNN(len(self._feature)), config.eval_cache_size)
 
     def think(self, game):
         import operator
         self._pattern = utils.extract_features(game.board.board, config.pattern_file_name)
         legal_moves = game.board.get_legal_moves()
         values_dict = {}
-        tmp_board = game.board.board
-        pattern_array = []
-        for x, y in legal_moves:
-            tmp_board[x][y] = game.current_player.stone_color
-            pattern_array.append(utils.extract_features(tmp_board, config.pattern_file_name))
-            #print(self._pattern)
-            #print(value)
-            tmp_board[x][y] = '.'
+        board_array = batch_features.boards_to_array([game.board.board])[0]
+        next_boards = batch_features.next_boards_array(board_array, legal_moves, game.current_player.stone_color)
 
-        values = self.CNN.run_value(pattern_array)
+        values = self.CNN.run_value(batch_features.extract_features_batch(next_boards, config.pattern_file_name))
         for index, (x, y) in enumerate(legal_moves):
             #print(values[index])
             values_dict[(x, y)] = values[index]
@@ -91,7 +114,7 @@ class GuiTestPlayer(GomokuPlayer):
 class RandomAIPlayer(GomokuPlayer):
     def think(self, game):
         time.sleep(0.1)
-        return random.choice(game.get_legal_moves())
+        return random.choice(game.board.get_legal_moves())
 
 
 class ReinforceAIPlayer(GomokuPlayer):
@@ -99,13 +122,23 @@ class ReinforceAIPlayer(GomokuPlayer):
         super(ReinforceAIPlayer, self).__init__(*args, **kwargs)
         self._move_event = Event()
         self._next_move = None
-        self.mul_values = [10000, 8000, 1000, 1000, 900, 100, 400, 110, 100, 60, 5, 5, 50, 50, -10000, -8000, -1000, -1000, -900, -100, -400, -110, -100, -60, -5, -5, -50, -50]
+        self.mul_values = config.reward_weights
         self._feature = utils.extract_features(Board().board, config.pattern_file_name)
         self.CNN = cnn.CriticNN(len(self._feature))
+        self.values = EvaluationCache(self.CNN, config.eval_cache_size)
         self.load_pattern = utils.file_to_patterns("pattern.txt")
+        self.replay = ReplayBuffer(len(self._feature))
+        self.trainer = ReplayTrainer(self.CNN, self.replay, config.replay_batch_size, config.replay_train_every,
+                                     config.replay_min_size)
+        self.book = load_book()
 
     def think(self, game):
-        legal_moves = game.board.get_legal_nearby_moves(2) or [(7, 7)]
+        # opening moves come from the book when there is one, and are not learned from
+        book_move = self.book.best_move(game.board) if self.book else None
+        if book_move:
+            return book_move
+
+        legal_moves = game.board.get_legal_nearby_moves(2) or [game.board.center]
         values_dict = {}
         pattern_array = []
         white_will_win = 0
@@ -118,13 +151,14 @@ class ReinforceAIPlayer(GomokuPlayer):
             max_eval = 10000
         occurence = game.board.occurrence
         od_value = sum([a*b for a,b in zip(occurence, self.mul_values)])
+        # candidates are tried on one private copy with push/pop
+        board = game.board.copy()
         for x, y in legal_moves:
-            b = Board(game.board)
-            b.put_stone((x, y))
-            pattern = b.get_features()
+            board.push((x, y))
+            pattern = board.get_features()
             print(pattern)
             pattern_array.append(pattern)
-            self_value = sum([a*b for a, b in zip(b.occurrence, self.mul_values)])
+            self_value = sum([a*b for a, b in zip(board.occurrence, self.mul_values)])
             if game.current_player.stone_color == 'b':
                 if self_value > max_eval:
                     max_eval = self_value
@@ -140,7 +174,7 @@ class ReinforceAIPlayer(GomokuPlayer):
                     if random.randint(0,9) >= 4:
                         max_eval_move = (x, y)
 
-            state = b.get_state()
+            state = board.get_state()
             if state == 1:
                 print('b win')
                 black_will_win = 1
@@ -149,11 +183,12 @@ class ReinforceAIPlayer(GomokuPlayer):
                 print('w win')
                 white_will_win = 1
                 max_point = (x, y)
+            board.pop()
 
         if max_eval_move == (-1, -1):
             max_eval_move = random.choice(legal_moves)
 
-        values = self.CNN.run_value(pattern_array)
+        values = self.values.run_value(pattern_array)
         value_set = set()
         for index, (x, y) in enumerate(legal_moves):
             values_dict[(x, y)] = values[index]
@@ -169,22 +204,21 @@ class ReinforceAIPlayer(GomokuPlayer):
             else:
                 max_point = max_eval_move
                 #max_point = random.choice(legal_moves)
-        b = Board(game.board)
-        b.put_stone(max_point)
         self._feature = game.board.get_features()
-        new_pattern = b.get_features()
+        board.push(max_point)
+        new_pattern = board.get_features()
         print(max_point)
         #print(values_dict[max_point])
         #print("new_pattern", new_pattern)
         #reward
         if black_will_win == 1:
             print("learning...reward 1")
-            print(self.CNN.run_learning([[1.]], [self._feature], [new_pattern]))
+            reward = 1.
         elif white_will_win == 1:
             print("learning...reward -1")
-            print(self.CNN.run_learning([[-1.]], [self._feature], [new_pattern]))
+            reward = -1.
         else:
-            new_occurence = b.occurrence
+            new_occurence = board.occurrence
             print("new_occur", new_occurence)
             self_occurence = game.board.occurrence
             self_value = sum([a*b for a,b in zip(self_occurence, self.mul_values)])
@@ -193,15 +227,21 @@ class ReinforceAIPlayer(GomokuPlayer):
             print("new value:", new_value)
             if new_value > self_value:
                 print("learning...reward 0.x")
-                print(self.CNN.run_learning([[0.00001 * (new_value - self_value)]], [self._feature], [new_pattern]))
             elif new_value < self_value:
                 print("learning...reward -0.x")
-                print(self.CNN.run_learning([[0.00001 * (new_value - self_value)]], [self._feature], [new_pattern]))
             else:
                 print("reward 0")
-                print(self.CNN.run_learning([[0.]], [self._feature], [new_pattern]))
+            reward = 0.00001 * (new_value - self_value)
+        # the critic learns from replayed minibatches in the trainer thread
+        self.replay.append(self._feature, reward, new_pattern)
+        self.trainer.notify()
         return max_point
 
+    def on_game_over(self, game):
+        # learn from what is left of the game before the checkpoint
+        self.trainer.stop()
+        self.CNN.end_game()
+
 
 class ReinforceRandomPlayer(GomokuPlayer):
     def __init__(self, *args, **kwargs):
@@ -226,6 +266,9 @@ class ReinforceRandomPlayer(GomokuPlayer):
             print(self.CNN.run_learning([[0.]], [self._pattern], [new_pattern]))
         return max_point
 
+    def on_game_over(self, game):
+        self.CNN.end_game()
+
 class LearningTestPlayer(GomokuPlayer):
     def __init__(self, *args, **kwargs):
         super(LearningTestPlayer, self).__init__(*args, **kwargs)
@@ -252,3 +295,262 @@ class LearningTestPlayer(GomokuPlayer):
                   print("reward 0")
                   print(self.CNN.run_learning([[0.]], [self._pattern], [new_pattern]))
               return max_point
+
+    def on_game_over(self, game):
+        self.CNN.end_game()
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class AlphaBetaPlayer(GomokuPlayer):
+    """Iterative-deepening negamax with alpha-beta pruning.
+
+    Positions are scored with the pattern occurrence of both colors, weighted
+    by the positive half of config.reward_weights. Moves are ordered by the
+    change in score their stone makes, after the best move stored in the
+    transposition table. Moves that win or stop the opponent from winning
+    at once are never cut from the list. The search runs on one board with push/pop
+    until time_limit seconds have passed or the search is cancelled. The
+    best move of every finished depth is reported as progress. Moves from
+    the opening book, then a forced win by continuous fours, are looked for
+    first; the solver gets a quarter of the time left. The statistics of
+    every move, with the source it came from, are kept in stats, and printed
+    if verbose is set.
+    """
+    verbose = False
+    time_limit = 2.
+    max_depth = 10
+    max_width = 10
+    nearby_length = 1
+    win_score = 1000000
+
+    def __init__(self, *args, **kwargs):
+        super(AlphaBetaPlayer, self).__init__(*args, **kwargs)
+        patterns = utils.file_to_patterns(config.pattern_file_name)
+        swapped = [p.replace('b', 'x').replace('w', 'b').replace('x', 'w') for p in patterns]
+        self._patterns = patterns + swapped
+        weights = config.reward_weights[:len(patterns)]
+        self._weights = weights + [-w for w in weights]
+        self.tt = TranspositionTable()
+        self.threats = ThreatSolver(node_budget=2000)
+        self.book = load_book()
+        self.nodes = 0
+        self.stats = {}
+
+    def think(self, game):
+        start = time.time()
+        self._deadline = start + self.time_limit
+        book_move = self.book.best_move(game.board) if self.book else None
+        if book_move:
+            self.stats = {'source': 'book'}
+            return book_move
+        board = Board(game.board.board, patterns=self._patterns, win_length=game.board.win_length)
+        moves = board.get_legal_nearby_moves(self.nearby_length) or [board.center]
+        if len(moves) == 1:
+            self.stats = {'source': 'single move'}
+            return moves[0]
+        # the solver gets a quarter of what is left of the budget
+        self.threats.time_limit = max(self._deadline - time.time(), 1e-3) / 4
+        line = self.threats.vcf(board)
+        if line:
+            self.stats = {'source': 'vcf', 'nodes': self.threats.stats['nodes'], 'time': time.time() - start}
+            if self.verbose:
+                print('VCF in %d moves, %d nodes' % ((len(line) + 1) // 2, self.threats.stats['nodes']))
+            return line[0]
+
+        self.nodes = 0
+        self.tt.new_search()
+        self.tt.clear_stats()
+        search_start = time.time()
+        root_moves = self._ordered_moves(board)
+        best_move, depth = root_moves[0], 0
+        self.report_progress(best_move, depth=0)
+        try:
+            for depth in range(1, self.max_depth + 1):
+                best_move, value, root_moves = self._search_root(board, root_moves, depth)
+                self.report_progress(best_move, depth=depth, value=value, nodes=self.nodes)
+                if abs(value) >= self.win_score:
+                    break
+        except SearchTimeout:
+            depth -= 1
+
+        elapsed = time.time() - search_start
+        self.stats = {'source': 'search', 'depth': depth, 'nodes': self.nodes, 'time': time.time() - start,
+                      'nodes_per_sec': self.nodes / elapsed if elapsed else 0,
+                      'tt': self.tt.stats()}
+        if self.verbose:
+            print('depth %d, %d nodes, %.0f nodes/sec, tt hit rate %.2f' %
+                  (depth, self.nodes, self.stats['nodes_per_sec'], self.stats['tt']['hit_rate']))
+        return best_move
+
+    def _search_root(self, board, moves, depth):
+        """Search moves to depth. Return the best move, its value and the moves reordered by value."""
+        alpha, beta = -self.win_score - 1, self.win_score + 1
+        scored = []
+        for move in moves:
+            value = self._search_move(board, move, depth, alpha, beta)
+            scored.append((value, move))
+            alpha = max(alpha, value)
+        scored.sort(key=operator.itemgetter(0), reverse=True)
+        return scored[0][1], scored[0][0], [move for _, move in scored]
+
+    def _search_move(self, board, move, depth, alpha, beta):
+        """Return the negamax value of move for the side to move."""
+        board.push(move)
+        state = board.get_state()
+        if state == 3:
+            value = 0
+        elif state:
+            value = self.win_score
+        else:
+            value = -self._negamax(board, depth - 1, -beta, -alpha)
+        board.pop()
+        return value
+
+    def _negamax(self, board, depth, alpha, beta):
+        self.nodes += 1
+        if time.time() > self._deadline or self.is_cancelled():
+            raise SearchTimeout()
+
+        entry = self.tt.get(board.hash)
+        tt_move = None
+        if entry is not None:
+            value, entry_depth, bound, tt_move = entry
+            if entry_depth >= depth:
+                if bound == EXACT:
+                    return value
+                elif bound == LOWER:
+                    alpha = max(alpha, value)
+                else:
+                    beta = min(beta, value)
+                if alpha >= beta:
+                    return value
+        if depth == 0:
+            value = self._evaluate(board)
+            self.tt.put(board.hash, value, 0, EXACT)
+            return value
+
+        original_alpha = alpha
+        best, best_move = -self.win_score - 1, None
+        for move in self._ordered_moves(board, tt_move):
+            value = self._search_move(board, move, depth, alpha, beta)
+            if value > best:
+                best, best_move = value, move
+                if value > alpha:
+                    alpha = value
+                    if alpha >= beta:
+                        break
+        if best <= original_alpha:
+            bound = UPPER
+        elif best >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.tt.put(board.hash, best, depth, bound, best_move)
+        return best
+
+    def _evaluate(self, board):
+        """Score the board for the side to move."""
+        score = sum([o*w for o, w in zip(board.occurrence, self._weights)])
+        return score if board.num_stone % 2 == 0 else -score
+
+    def _ordered_moves(self, board, first=None):
+        """Return nearby moves, first and then best first by the occurrence change they make.
+
+        Moves completing a five for either side are all kept, the others are cut to max_width moves in total.
+        """
+        sign = 1 if board.num_stone % 2 == 0 else -1
+        opponent = 'w' if sign == 1 else 'b'
+        scored = []
+        for move in board.get_legal_nearby_moves(self.nearby_length) or []:
+            if move == first:
+                continue
+            delta = board.push(move)
+            if board.get_state() in [1, 2]:
+                score = self.win_score
+            else:
+                score = sign * sum([d*w for d, w in zip(delta, self._weights)])
+            board.pop()
+            # the patterns do not tell a closed four from nothing, so its block is found here
+            if score < self.win_score and board.is_five_point(move, opponent):
+                score = self.win_score - 1
+            scored.append((score, move))
+        scored.sort(key=operator.itemgetter(0), reverse=True)
+        forced = [move for score, move in scored if score >= self.win_score - 1]
+        width = self.max_width - len(forced) - (first is not None)
+        moves = forced + [move for score, move in scored[len(forced):len(forced) + max(width, 0)]]
+        if first is not None:
+            moves = [first] + moves
+        return moves
+
+
+class MCTSPlayer(GomokuPlayer):
+    """Monte Carlo tree search over nearby moves, evaluating leaves with the critic in batches.
+
+    The tree is kept between moves of the same game. It is searched for
+    simulations simulations, or until time_limit seconds passed if set,
+    unless the opening book has a move or a forced win by continuous fours
+    is found first. The search stops early when cancelled, and the most
+    visited move is reported as progress after every batch. The statistics
+    of the search are printed if verbose is set.
+    """
+    verbose = False
+    simulations = 800
+    time_limit = None
+    batch_size = 16
+
+    def __init__(self, *args, **kwargs):
+        super(MCTSPlayer, self).__init__(*args, **kwargs)
+        self._patterns = utils.file_to_patterns(config.pattern_file_name)
+        self._feature = utils.extract_features(Board().board, self._patterns)
+        self.CNN = EvaluationCache(NumpyCriticNN(len(self._feature)), config.eval_cache_size)
+        self.mcts = MCTS(self.CNN, batch_size=self.batch_size)
+        self.threats = ThreatSolver(node_budget=2000, time_limit=.5)
+        self.book = load_book()
+        self._board = None
+
+    def think(self, game):
+        self._sync(game.board)
+        book_move = self.book.best_move(self._board) if self.book else None
+        line = None if book_move else self.threats.vcf(self._board)
+        if book_move:
+            move = book_move
+        elif line:
+            move = line[0]
+            if self.verbose:
+                print('VCF in %d moves, %d nodes' % ((len(line) + 1) // 2, self.threats.stats['nodes']))
+        else:
+            start = time.time()
+            simulations = self.mcts.search(self._board, self.simulations, self.time_limit, stop=self.cancel,
+                                           progress=self._report_search)
+            move = self.mcts.best_move() or self._board.center
+            if self.verbose:
+                elapsed = max(time.time() - start, 1e-9)
+                print('%d simulations, %.0f simulations/sec, %d root visits' %
+                      (simulations, simulations / elapsed, self.mcts.root.visits))
+        self.mcts.advance(move)
+        self._board.put_stone(move)
+        return move
+
+    def _report_search(self, simulations):
+        self.report_progress(self.mcts.best_move(), simulations=simulations)
+
+    def _sync(self, board):
+        """Follow the opponent's move in the tree, or start a new tree if the boards do not line up."""
+        if self._board is not None and board.num_stone == self._board.num_stone and board.board == self._board.board:
+            return
+        if self._board is not None and board.num_stone == self._board.num_stone + 1:
+            current, mine = board.board, self._board.board
+            new = [(r, c) for r in range(board.size) for c in range(board.size) if current[r][c] != mine[r][c]]
+            if len(new) == 1 and mine[new[0][0]][new[0][1]] == '.':
+                self.mcts.advance(new[0])
+                self._board.put_stone(new[0])
+                return
+        self._board = Board(board.board, patterns=self._patterns, win_length=board.win_length)
+        self.mcts.reset()
+
+    def on_game_over(self, game):
+        self._board = None
+        self.mcts.reset()
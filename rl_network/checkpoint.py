@@ -0,0 +1,31 @@
+import time
+
+
+class CheckpointPolicy:
+    """Decide when CriticNN writes its checkpoint.
+
+    :param every_steps: Save after this many learning steps. None to disable.
+    :param every_seconds: Save when this many seconds passed since the last save. None to disable.
+    :param on_game_end: Save when a game is over.
+    :param at_shutdown: Save when the interpreter exits.
+    """
+    def __init__(self, every_steps=100, every_seconds=60., on_game_end=True, at_shutdown=True):
+        self.every_steps = every_steps
+        self.every_seconds = every_seconds
+        self.on_game_end = on_game_end
+        self.at_shutdown = at_shutdown
+        self.unsaved_steps = 0
+        self._last_save = time.time()
+
+    def step(self):
+        """Record a learning step. Return True if a checkpoint is due."""
+        self.unsaved_steps += 1
+        if self.every_steps is not None and self.unsaved_steps >= self.every_steps:
+            return True
+        if self.every_seconds is not None and time.time() - self._last_save >= self.every_seconds:
+            return True
+        return False
+
+    def saved(self):
+        self.unsaved_steps = 0
+        self._last_save = time.time()
@@ -1,11 +1,26 @@
-import tensorflow as tf
+import atexit
 import os
+import weakref
+
+import tensorflow as tf
+import numpy as np
+
+from rl_network.checkpoint import CheckpointPolicy
+
+# critics still open, closed at exit; a weak set so the hook does not keep them alive
+_open_critics = weakref.WeakSet()
+
+
+@atexit.register
+def _close_open_critics():
+    for critic in list(_open_critics):
+        critic.close()
 
 
 class CriticNN:
     
     def __init__(self, input_size=274, hidden_size=100, alpha=0.1, discount=0.9, learn_rate=0.1, step=100,
-                 model_dir='model/', model_name='model'):
+                 model_dir='model/', model_name='model', checkpoint_policy=None):
         self._alpha = alpha
         self._discount = discount
         self._learn_rate = learn_rate
@@ -13,22 +28,38 @@ class CriticNN:
         self._hidden_size = hidden_size
         self._step = step
         self._model_path = model_dir + model_name + '.ckpt'
+        self._weights_path = model_dir + model_name + '.npz'
+        self._checkpoint_policy = checkpoint_policy or CheckpointPolicy(every_steps=step)
         if not os.path.isdir(model_dir):
             os.system('mkdir ' + model_dir)
 
+        # The whole graph is built here once; run_value and run_learning only feed it.
         self._graph = tf.Graph()
         with self._graph.as_default():
             self._W1 = tf.Variable(tf.zeros([self._input_size, self._hidden_size]), name='W1')
             self._W2 = tf.Variable(tf.zeros([self._hidden_size, 1]), name='W2')
+
+            self._input, self._reward_next, self._next_input = self.placeholders()
+            self._value_op = self.inference(self._input)
+            self._train_op = self.train_op(self._input, self._reward_next, self._next_input)
+            self._target = tf.placeholder(tf.float32, shape=[None, 1])
+            self._target_train_op = self.target_train_op(self._input, self._target)
+
             self._saver = tf.train.Saver()
+            init = tf.initialize_all_variables()
+            self._graph.finalize()
 
             self._sess = tf.Session(graph=self._graph)
             if os.path.exists(self._model_path):
                 self._saver.restore(self._sess, self._model_path)
             else:
-                init = tf.initialize_all_variables()
                 self._sess.run(init)
 
+        # incremented by every training step, so cached values can tell they are stale
+        self.version = 0
+
+        _open_critics.add(self)
+
     # build one hidden layer graph
     def inference(self, input_layer):
         with tf.name_scope('hidden'):
@@ -62,30 +93,85 @@ class CriticNN:
 
         return train_op
 
-    def run_value(self, x):
-        with self._graph.as_default():
-            input_placeholder = tf.placeholder(tf.float32, shape=[None, self._input_size])
-            logits = self.inference(input_placeholder)
-            value = self._sess.run(logits, feed_dict={input_placeholder: x})
+    def target_train_op(self, input_placeholder, target_placeholder):
+        optimizer = tf.train.GradientDescentOptimizer(learning_rate=self._learn_rate)
+        logits = self.inference(input_placeholder)
+        # e = alpha*(target - v(t)), E = 1/2 * e^2
+        e = tf.mul(self._alpha, tf.sub(target_placeholder, logits))
+        loss = tf.mul(0.5, tf.pow(e, 2))
+        return optimizer.minimize(loss)
 
-        return value
+    def run_value(self, x):
+        return self._sess.run(self._value_op, feed_dict={self._input: x})
+
+    def run_train(self, reward_next, x_current, x_next):
+        """Run one gradient step on a batch of transitions."""
+        feed_dict = {self._reward_next: reward_next,
+                     self._next_input: x_next,
+                     self._input: x_current}
+
+        self._sess.run(self._train_op, feed_dict=feed_dict)
+        self.version += 1
+        if self._checkpoint_policy.step():
+            self.save()
+
+    def run_train_targets(self, targets, x):
+        """Run one gradient step moving the values of a batch toward given targets, like TD(lambda) returns."""
+        self._sess.run(self._target_train_op, feed_dict={self._target: targets, self._input: x})
+        self.version += 1
+        if self._checkpoint_policy.step():
+            self.save()
 
     def run_learning(self, reward_next, x_current, x_next):
-        with self._graph.as_default():
-            input_placeholder, reward_next_placeholder, next_input_placeholder = self.placeholders()
-            train_op = self.train_op(input_placeholder, reward_next_placeholder, next_input_placeholder)
-            
-            feed_dict = {reward_next_placeholder: reward_next,
-                         next_input_placeholder: x_next,
-                         input_placeholder: x_current}
-
-            self._sess.run(train_op, feed_dict=feed_dict)
-            self._saver.save(self._sess, self._model_path)
+        self.run_train(reward_next, x_current, x_next)
 
         v_current = self.run_value(x_current)
         v_next = self.run_value(x_next)
         return v_current, v_next
 
+    def save(self):
+        """Write the checkpoint and the exported weights.
+
+        The checkpoint is saved under a temporary name and renamed, so concurrent readers never see a
+        partial file, and two players sharing model_dir never interleave their writes.
+        """
+        tmp_path = '%s.tmp-%d-%d' % (self._model_path, os.getpid(), id(self))
+        self._saver.save(self._sess, tmp_path)
+        os.replace(tmp_path, self._model_path)
+        if os.path.exists(tmp_path + '.meta'):
+            os.replace(tmp_path + '.meta', self._model_path + '.meta')
+        self.export_weights()
+        self._checkpoint_policy.saved()
+
+    def end_game(self):
+        """Save if the checkpoint policy asks for it at the end of a game."""
+        if self._checkpoint_policy.on_game_end and self._checkpoint_policy.unsaved_steps:
+            self.save()
+
+    def close(self):
+        """Save if the checkpoint policy asks for it at shutdown, then close the session. Safe to call twice."""
+        if self._sess is None:
+            return
+        _open_critics.discard(self)
+        try:
+            if self._checkpoint_policy.at_shutdown and self._checkpoint_policy.unsaved_steps:
+                self.save()
+        finally:
+            self._sess.close()
+            self._sess = None
+
+    def export_weights(self, path=None):
+        """Write W1 and W2 to an .npz file for NumpyCriticNN.
+
+        The file is written under a temporary name and renamed, so readers never see a partial file.
+        """
+        path = path or self._weights_path
+        W1, W2 = self._sess.run([self._W1, self._W2])
+        tmp_path = '%s.tmp-%d-%d' % (path, os.getpid(), id(self))
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, W1=W1, W2=W2)
+        os.replace(tmp_path, path)
+
 
 def test():
     CNN = CriticNN(3)
@@ -0,0 +1,68 @@
+from collections import OrderedDict
+
+import numpy as np
+
+
+class EvaluationCache:
+    """LRU cache of critic values in front of run_value.
+
+    Values are keyed on the feature vector. The features are pattern counts
+    over the whole board, so they are the same for the 8 rotations and
+    reflections of a position, and a position is evaluated once for all of
+    them. Cached values are dropped when the critic's version changes, which
+    happens when it trains or loads new weights.
+
+    :param critic: CriticNN or NumpyCriticNN.
+    :param size: Maximum number of cached values.
+    """
+    def __init__(self, critic, size=100000):
+        self.critic = critic
+        self.size = size
+        self._values = OrderedDict()
+        self._version = critic.version
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def version(self):
+        return self.critic.version
+
+    def clear(self):
+        self._values.clear()
+
+    def run_value(self, x):
+        """Return the values of a batch of feature vectors, like critic.run_value."""
+        version = self.critic.version
+        if version != self._version:
+            self._values.clear()
+            self._version = version
+
+        values = np.empty([len(x), 1], dtype=np.float32)
+        # tuples hash equal whether the features are ints or floats, and building them is
+        # cheaper than converting a list of feature lists to an array
+        keys = [tuple(row) for row in (x.tolist() if isinstance(x, np.ndarray) else x)]
+        missing = []
+        for i, key in enumerate(keys):
+            value = self._values.get(key)
+            if value is None:
+                missing.append(i)
+            else:
+                self._values.move_to_end(key)
+                values[i, 0] = value
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            # all misses of the batch are evaluated with one call
+            new_values = self.critic.run_value([x[i] for i in missing])
+            for i, value in zip(missing, new_values[:, 0]):
+                values[i, 0] = value
+                self._values[keys[i]] = value
+            while len(self._values) > self.size:
+                self._values.popitem(last=False)
+        return values
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.,
+                'entries': len(self._values), 'size': self.size}
@@ -0,0 +1,81 @@
+import os
+import time
+
+import numpy as np
+
+
+def sigmoid(x):
+    return 1. / (1. + np.exp(-x))
+
+
+def read_checkpoint(path):
+    """Read W1 and W2 from a CriticNN checkpoint. Needs TensorFlow."""
+    import tensorflow as tf
+    reader = tf.train.NewCheckpointReader(path)
+    return reader.get_tensor('W1'), reader.get_tensor('W2')
+
+
+class NumpyCriticNN:
+    """Inference-only CriticNN that evaluates the network with NumPy.
+
+    Weights are read from the .npz file CriticNN exports next to its
+    checkpoint, or from the checkpoint itself when there is no .npz yet. The
+    files are checked at most every reload_interval seconds and newer weights
+    are picked up without restarting.
+    """
+    def __init__(self, input_size=274, hidden_size=100, model_dir='model/', model_name='model',
+                 reload_interval=1.):
+        self._input_size = input_size
+        self._hidden_size = hidden_size
+        self._weights_path = model_dir + model_name + '.npz'
+        self._model_path = model_dir + model_name + '.ckpt'
+        self._reload_interval = reload_interval
+        self._last_check = 0
+        self._loaded = None
+        # same initial weights as CriticNN
+        self._W1 = np.zeros([input_size, hidden_size], dtype=np.float32)
+        self._W2 = np.zeros([hidden_size, 1], dtype=np.float32)
+        self._version = 0
+        self.reload()
+
+    @property
+    def version(self):
+        """Incremented every time new weights are loaded. Reading it checks for new weights like run_value."""
+        self._check_reload()
+        return self._version
+
+    def _check_reload(self):
+        if time.time() - self._last_check >= self._reload_interval:
+            self.reload()
+
+    def reload(self):
+        """Load the weights if they changed since the last load. Return True if new weights were loaded."""
+        self._last_check = time.time()
+        for path in (self._weights_path, self._model_path):
+            if os.path.exists(path):
+                break
+        else:
+            return False
+
+        stamp = (path, os.path.getmtime(path))
+        if stamp == self._loaded:
+            return False
+
+        if path == self._weights_path:
+            with np.load(path) as weights:
+                W1, W2 = weights['W1'], weights['W2']
+        else:
+            W1, W2 = read_checkpoint(path)
+        if W1.shape != (self._input_size, self._hidden_size) or W2.shape != (self._hidden_size, 1):
+            raise Exception('Weights in %s do not match the network size' % path)
+
+        self._W1 = W1.astype(np.float32)
+        self._W2 = W2.astype(np.float32)
+        self._loaded = stamp
+        self._version += 1
+        return True
+
+    def run_value(self, x):
+        self._check_reload()
+        hidden = sigmoid(np.dot(np.asarray(x, dtype=np.float32), self._W1))
+        return sigmoid(np.dot(hidden, self._W2))
@@ -0,0 +1,152 @@
+import random
+import threading
+
+import numpy as np
+
+
+class ReplayBuffer:
+    """Fixed-capacity store of (features, reward, next_features) transitions.
+
+    Transitions live in preallocated NumPy arrays used as a ring. Once the
+    buffer is full, eviction='fifo' overwrites the oldest transition and
+    eviction='reservoir' keeps a uniform sample of everything appended so far.
+    """
+    def __init__(self, feature_size, capacity=100000, eviction='fifo'):
+        if eviction not in ['fifo', 'reservoir']:
+            raise Exception('eviction should be "fifo" or "reservoir"')
+        self.capacity = capacity
+        self.eviction = eviction
+        self._features = np.zeros([capacity, feature_size], dtype=np.float32)
+        self._rewards = np.zeros([capacity, 1], dtype=np.float32)
+        self._next_features = np.zeros([capacity, feature_size], dtype=np.float32)
+        self._size = 0
+        self._next_index = 0
+        # number of transitions ever appended
+        self.appended = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def append(self, features, reward, next_features):
+        with self._lock:
+            self.appended += 1
+            if self._size < self.capacity:
+                index = self._size
+                self._size += 1
+            elif self.eviction == 'fifo':
+                index = self._next_index
+                self._next_index = (self._next_index + 1) % self.capacity
+            else:
+                index = random.randrange(self.appended)
+                if index >= self.capacity:
+                    return
+            self._features[index] = features
+            self._rewards[index] = reward
+            self._next_features[index] = next_features
+
+    def sample(self, batch_size):
+        """Return (rewards, features, next_features) arrays of batch_size random transitions."""
+        with self._lock:
+            index = np.random.randint(0, self._size, batch_size)
+            return self._rewards[index], self._features[index], self._next_features[index]
+
+
+class ReplayTrainer:
+    """Train a critic on minibatches sampled from a ReplayBuffer in a background thread.
+
+    One minibatch is trained for every train_every transitions appended to the
+    buffer, once it holds at least min_size transitions. Appending never waits
+    for training. The thread is started by the first notify and ended by stop,
+    which trains on the transitions left, so short runs are learned from too.
+    """
+    def __init__(self, critic, buffer, batch_size=64, train_every=16, min_size=256):
+        self.critic = critic
+        self.buffer = buffer
+        self.batch_size = batch_size
+        self.train_every = train_every
+        self.min_size = min_size
+        self.steps = 0
+        self._trained_until = 0
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def notify(self):
+        """Tell the trainer that new transitions were appended."""
+        if self._thread is None:
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        self._wakeup.set()
+
+    def stop(self):
+        """End the thread, then flush."""
+        if self._thread is not None:
+            self._stopped = True
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def flush(self):
+        """Train the minibatches due for the transitions appended since the last one, even below min_size.
+
+        Like the ones trained by the thread, the minibatches are sampled from the whole buffer.
+        """
+        while len(self.buffer) and self.buffer.appended > self._trained_until:
+            self._trained_until += self.train_every
+            self.critic.run_train(*self.buffer.sample(min(self.batch_size, len(self.buffer))))
+            self.steps += 1
+
+    def _due(self):
+        return (len(self.buffer) >= self.min_size and
+                self.buffer.appended - self._trained_until >= self.train_every)
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            while not self._stopped and self._due():
+                self._trained_until += self.train_every
+                self.critic.run_train(*self.buffer.sample(self.batch_size))
+                self.steps += 1
+
+
+if __name__ == '__main__':
+    import time
+    from rl_network.checkpoint import CheckpointPolicy
+    from rl_network.critic_network import CriticNN
+
+    feature_size = 73
+    n = 2000
+    critic = CriticNN(feature_size, model_dir='/tmp/replay_bench/', checkpoint_policy=CheckpointPolicy(
+        every_steps=None, every_seconds=None, on_game_end=False, at_shutdown=False))
+    x = np.random.randint(0, 2, [n, feature_size]).astype(np.float32)
+    r = np.random.uniform(-1, 1, [n, 1]).astype(np.float32)
+
+    start = time.time()
+    for i in range(n - 1):
+        critic.run_learning(r[i:i + 1], x[i:i + 1], x[i + 1:i + 2])
+    single = (n - 1) / (time.time() - start)
+
+    buffer = ReplayBuffer(feature_size, capacity=n)
+    for i in range(n - 1):
+        buffer.append(x[i], r[i, 0], x[i + 1])
+    start = time.time()
+    for _ in range(100):
+        critic.run_train(*buffer.sample(256))
+    batched = 100 * 256 / (time.time() - start)
+    # what a player gets: one game of appends, trained in the background and flushed at the end
+    buffer = ReplayBuffer(feature_size, capacity=n)
+    trainer = ReplayTrainer(critic, buffer)
+    start = time.time()
+    for i in range(n - 1):
+        buffer.append(x[i], r[i, 0], x[i + 1])
+        trainer.notify()
+    trainer.stop()
+    replayed = trainer.steps * trainer.batch_size / (time.time() - start)
+    print('single-sample run_learning: %.0f transitions/sec' % single)
+    print('minibatch of 256: %.0f transitions/sec' % batched)
+    print('ReplayTrainer, batch of %d every %d appends: %.0f transitions/sec trained, %d steps' %
+          (trainer.batch_size, trainer.train_every, replayed, trainer.steps))
@@ -0,0 +1,147 @@
+# Multiprocess self-play: worker processes play games and a learner trains the critic.
+import argparse
+import contextlib
+import multiprocessing
+import os
+import random
+import time
+
+import config
+from game import GomokuGame, MoveEvent, game_transitions
+from player import GomokuPlayer
+from utils import extract_features, file_to_patterns
+
+
+class SelfPlayPlayer(GomokuPlayer):
+    """Pick the move the critic likes best, or a random nearby move with probability epsilon.
+
+    All players in a worker process share one inference backend, set in critic.
+    """
+    critic = None
+    epsilon = 0.1
+
+    def think(self, game):
+        moves = game.board.get_legal_nearby_moves(2) or [game.board.center]
+        if random.random() < self.epsilon:
+            return random.choice(moves)
+
+        features = []
+        # candidates are tried on one private copy with push/pop
+        board = game.board.copy()
+        for move in moves:
+            board.push(move)
+            won = board.get_state() in [1, 2]
+            features.append(board.get_features())
+            board.pop()
+            if won:
+                return move
+        values = self.critic.run_value(features)[:, 0]
+        best = values.argmax() if self.stone_color == 'b' else values.argmin()
+        return moves[best]
+
+
+def play_game():
+    """Play one self-play game. Return (moves, state)."""
+    moves = []
+    game = GomokuGame(SelfPlayPlayer, SelfPlayPlayer)
+    game.add_observer(lambda event: moves.append(event.move) if isinstance(event, MoveEvent) else None)
+    game.start()
+    return moves, game.board.get_state()
+
+
+def worker(records, stop, seed, model_dir):
+    """Play games until stop is set and put (moves, state) records on the records queue."""
+    # imported here so that only the learner loads TensorFlow sessions
+    from rl_network.eval_cache import EvaluationCache
+    from rl_network.numpy_critic import NumpyCriticNN
+
+    random.seed(seed)
+    feature_size = len(extract_features(GomokuGame(GomokuPlayer, GomokuPlayer).board.board, config.pattern_file_name))
+    SelfPlayPlayer.critic = EvaluationCache(NumpyCriticNN(feature_size, model_dir=model_dir), config.eval_cache_size)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        while not stop.is_set():
+            records.put(play_game())
+
+
+def learn(num_workers, num_games, model_dir='model/', batch_size=256, train_every=1, broadcast_every=20,
+          book_path=None, record_dir=None):
+    """Run self-play workers and train the critic on the games they stream back.
+
+    :param num_workers: Number of worker processes.
+    :param num_games: Stop after this many games.
+    :param train_every: Train one minibatch for every train_every games received.
+    :param broadcast_every: Publish new weights to the workers every broadcast_every games.
+    :param book_path: If set, write an opening book of the games played there.
+    :param record_dir: If set, append the games played to game records there.
+    """
+    size, win_length = config.board_size, config.win_length
+    if book_path and (size, win_length) != (15, 5):
+        raise Exception('Opening books can only be written for 15x15 boards with five in a row')
+    from rl_network.checkpoint import CheckpointPolicy
+    from rl_network.critic_network import CriticNN
+    from rl_network.replay_buffer import ReplayBuffer
+
+    patterns = file_to_patterns(config.pattern_file_name)
+    feature_size = len(extract_features(GomokuGame(GomokuPlayer, GomokuPlayer).board.board, patterns))
+    critic = CriticNN(feature_size, model_dir=model_dir,
+                      checkpoint_policy=CheckpointPolicy(every_steps=None, on_game_end=False))
+    critic.export_weights()
+    replay = ReplayBuffer(feature_size)
+    if record_dir:
+        from game_record import GameRecordWriter
+        records_writer = GameRecordWriter(record_dir, size=size, win_length=win_length)
+
+    # workers must not inherit the TensorFlow session, so they are spawned, not forked
+    context = multiprocessing.get_context('spawn')
+    records = context.Queue(maxsize=num_workers * 4)
+    stop = context.Event()
+    workers = [context.Process(target=worker, args=(records, stop, random.randrange(2**32), model_dir), daemon=True)
+               for _ in range(num_workers)]
+    for w in workers:
+        w.start()
+
+    start = time.time()
+    results = [0, 0, 0, 0]
+    # opening moves of every game, kept for the opening book
+    openings = []
+    try:
+        for n in range(1, num_games + 1):
+            moves, state = records.get()
+            results[state] += 1
+            if record_dir:
+                records_writer.write(moves, state)
+            if book_path:
+                openings.append((moves[:config.opening_book_plies], state))
+            for features, reward, next_features in game_transitions(moves, patterns, size, win_length):
+                replay.append(features, reward, next_features)
+            if n % train_every == 0 and len(replay) >= batch_size:
+                critic.run_train(*replay.sample(batch_size))
+            if n % broadcast_every == 0:
+                critic.save()
+                print('%d games, %.2f games/sec, black %d, white %d, draw %d' %
+                      (n, n / (time.time() - start), results[1], results[2], results[3]))
+    finally:
+        stop.set()
+        critic.save()
+        for w in workers:
+            w.join(timeout=1)
+            if w.is_alive():
+                w.terminate()
+    if book_path:
+        from opening_book import build_book
+        print('%d opening book entries' % build_book(openings, book_path))
+    return n / (time.time() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Multiprocess self-play for the critic network.')
+    parser.add_argument('-w', '--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('-n', '--games', type=int, default=1000)
+    parser.add_argument('--model-dir', default='model/')
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--broadcast-every', type=int, default=20)
+    parser.add_argument('--book', help='write an opening book of the games to this file')
+    parser.add_argument('--records', help='append the games to game records in this directory')
+    args = parser.parse_args()
+    learn(args.workers, args.games, model_dir=args.model_dir, batch_size=args.batch_size,
+          broadcast_every=args.broadcast_every, book_path=args.book, record_dir=args.records)
@@ -0,0 +1,56 @@
+import contextlib
+import io
+
+from game import Board
+from player import AlphaBetaPlayer
+
+
+class Game:
+    def __init__(self, board):
+        self.board = board
+
+
+def four_to_block():
+    """White has four in column 6 open at (9, 6), black to move."""
+    board = [['.'] * 15 for _ in range(15)]
+    for row in range(5, 9):
+        board[row][6] = 'w'
+    for row, col in [(4, 6), (6, 7), (7, 8), (5, 8)]:
+        board[row][col] = 'b'
+    return board
+
+
+def make_player():
+    player = AlphaBetaPlayer('b')
+    player.book = None
+    player.time_limit = 1.
+    return player
+
+
+def test_ordered_moves_keep_block_of_four():
+    player = make_player()
+    board = Board(four_to_block(), patterns=player._patterns)
+    assert (9, 6) in player._ordered_moves(board)
+    assert (9, 6) in player._ordered_moves(board, first=(3, 3))
+
+
+def test_blocks_four():
+    player = make_player()
+    with contextlib.redirect_stdout(io.StringIO()):
+        move = player.think(Game(Board(four_to_block())))
+    assert move == (9, 6)
+
+
+def test_stats_follow_each_move():
+    player = make_player()
+    with contextlib.redirect_stdout(io.StringIO()):
+        player.think(Game(Board(four_to_block())))
+    assert player.stats['source'] == 'search'
+    assert player.threats.time_limit <= player.time_limit / 4
+    board = four_to_block()
+    for col in range(3, 7):
+        board[10][col] = 'b'
+    with contextlib.redirect_stdout(io.StringIO()):
+        move = player.think(Game(Board(board)))
+    assert move in [(10, 2), (10, 7)]
+    assert player.stats['source'] == 'vcf'
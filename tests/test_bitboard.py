@@ -0,0 +1,49 @@
+import random
+
+import pytest
+
+from bitboard import BitBoard
+from game import Board
+from utils import file_to_patterns, zobrist_hash
+
+PATTERNS = file_to_patterns('pattern.txt')
+
+
+@pytest.mark.parametrize('size, win_length', [(15, 5), (9, 5), (11, 4), (19, 5)])
+def test_parity_with_board(size, win_length):
+    random.seed(size * 10 + win_length)
+    for _ in range(5):
+        b = Board(patterns=PATTERNS, size=size, win_length=win_length)
+        bb = BitBoard(patterns=PATTERNS, size=size, win_length=win_length)
+        while b.get_state() == 0:
+            move = random.choice(b.get_legal_moves())
+            assert b.push(move) == bb.push(move)
+            assert b.board == bb.board
+            assert b.num_stone == bb.num_stone
+            assert b.get_legal_moves() == bb.get_legal_moves()
+            assert b.get_legal_nearby_moves(2) == bb.get_legal_nearby_moves(2)
+            assert b.get_state() == bb.get_state()
+            assert b.occurrence == bb.occurrence
+            assert b.get_features() == bb.get_features()
+            assert b.lines_through(move) == bb.lines_through(move)
+            assert BitBoard(b.board, PATTERNS, win_length=win_length).occurrence == bb.occurrence
+            assert BitBoard(b.board, PATTERNS, win_length=win_length).get_state() == bb.get_state()
+            assert b.hash == bb.hash == zobrist_hash(b.board)
+        copy = bb.copy()
+        while b.num_stone:
+            assert b.pop() == bb.pop()
+            assert b.board == bb.board
+            assert b.occurrence == bb.occurrence == Board(b.board, PATTERNS, win_length=win_length).occurrence
+            assert b.get_state() == bb.get_state() == 0
+            assert b.hash == bb.hash == zobrist_hash(b.board)
+        # popping the original leaves its copy alone
+        assert copy.num_stone > 0 and copy.board != bb.board
+
+
+def test_empty_mask():
+    bb = BitBoard(patterns=PATTERNS)
+    bb.put_stone((7, 7))
+    bb.put_stone((0, 14))
+    assert bb.empty_mask.bit_count() == 223
+    assert bb._layout.cells_of(bb.empty_mask) == bb.get_legal_moves()
+    assert (7, 7) not in bb.get_legal_moves() and (0, 14) not in bb.get_legal_moves()
@@ -0,0 +1,37 @@
+import threading
+import time
+
+from player import GomokuPlayer
+from think_executor import ThinkExecutor
+
+
+class SlowPlayer(GomokuPlayer):
+    """Reports a move, then keeps thinking for a while after it is cancelled."""
+    def __init__(self, *args, **kwargs):
+        super(SlowPlayer, self).__init__(*args, **kwargs)
+        self.running = threading.Semaphore(1)
+        self.cancelled_at_return = []
+
+    def think(self, game):
+        assert self.running.acquire(blocking=False), 'think started before the previous one returned'
+        self.report_progress((1, 1))
+        while not self.is_cancelled():
+            time.sleep(.01)
+        time.sleep(.2)
+        self.cancelled_at_return.append(self.is_cancelled())
+        self.running.release()
+        return (2, 2)
+
+
+def test_cancel_lasts_until_think_returns():
+    executor = ThinkExecutor(time_limit=.05, grace=.05)
+    player = SlowPlayer('b')
+    try:
+        assert executor.think(player, None) == (1, 1)
+        assert player.cancel is not None and player.cancel.is_set()
+        assert executor.think(player, None) == (1, 1)
+        time.sleep(.4)
+    finally:
+        executor.shutdown()
+    assert player.cancelled_at_return == [True, True]
+    assert player.cancel is None and player.progress_callback is None
@@ -0,0 +1,54 @@
+import json
+
+import numpy as np
+
+from rl_network.checkpoint import CheckpointPolicy
+from train import OfflineTrainer, ShuffleWindow
+
+
+class Critic:
+    def __init__(self):
+        self.trained = []
+
+    def run_train_targets(self, targets, features):
+        self.trained.extend(features[:, 0].astype(int))
+
+    def save(self):
+        pass
+
+
+def samples(game, n):
+    return np.full([n, 2], game, dtype=np.float32), np.zeros([n, 1], dtype=np.float32)
+
+
+def test_shuffle_window_keeps_game_of_samples():
+    window = ShuffleWindow(10, 2)
+    pushed_out = [window.add(*samples(game, 4), game) for game in range(5)]
+    assert len(window) == 10 and window.oldest_game() <= 2
+    for features, targets, games in pushed_out:
+        assert len(features) == len(targets) == len(games)
+        assert (features[:, 0] == games).all()
+    features, targets, games = window.drain()
+    assert len(window) == 0 and window.oldest_game() is None
+    assert (features[:, 0] == games).all()
+    assert sum(len(f) for f, _, _ in pushed_out) + len(features) == 20
+
+
+def test_checkpoint_counts_only_trained_games(tmp_path):
+    path = tmp_path / 'progress.json'
+    window = ShuffleWindow(6, 2)
+    critic = Critic()
+    trainer = OfflineTrainer(critic, 4, CheckpointPolicy(every_steps=1, every_seconds=None), str(path),
+                             window=window)
+    trainer.games = 3
+    for _ in range(6):
+        game, trainer.games = trainer.games, trainer.games + 1
+        trainer.add(*window.add(*samples(game, 3), game))
+        saved = json.load(open(str(path)))['games'] if path.exists() else 3
+        # every game before the saved count has all of its samples trained on
+        assert all(critic.trained.count(g) == 3 for g in range(3, saved))
+        assert saved <= min([trainer.games] + [g for g in range(3, trainer.games) if critic.trained.count(g) < 3])
+    trainer.add(*window.drain())
+    trainer.flush()
+    assert json.load(open(str(path)))['games'] == 9
+    assert sorted(critic.trained) == sorted(list(range(3, 9)) * 3)
@@ -0,0 +1,79 @@
+# Run the think of players in worker threads under a per-move deadline.
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import config
+
+
+class ThinkExecutor:
+    """Run player.think in a thread pool, so that the caller can bound and cancel it.
+
+    When time_limit seconds have passed, the player's cancel event is set.
+    Players that support it (AlphaBetaPlayer, MCTSPlayer) then return their
+    best move so far. Moves a player reports with report_progress are passed
+    on to the progress callback, and the last one is played if think has
+    not returned grace seconds after the cancel. Players that reported
+    nothing are waited for, since there is no move to fall back to, and
+    interactive players are never given a deadline. A think that outlives
+    its move keeps its cancel event until it returns, and the player does
+    not think again before then.
+    """
+    def __init__(self, time_limit=config.think_time_limit, grace=.5, max_workers=2):
+        self.time_limit = time_limit
+        self.grace = grace
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._cancel = None
+        # player -> Event set once its last think has returned and the player is reset
+        self._idle = weakref.WeakKeyDictionary()
+
+    def think(self, player, game, progress=None):
+        """Return the move of player, calling progress with every ProgressEvent it reports."""
+        best = []
+
+        def report(event):
+            best.append(event.move)
+            if progress is not None:
+                progress(event)
+
+        idle = self._idle.get(player)
+        if idle is not None:
+            idle.wait()
+        idle = threading.Event()
+        cancel = self._cancel = threading.Event()
+        player.cancel = cancel
+        player.progress_callback = report
+
+        def done(future):
+            player.cancel = None
+            idle.set()
+        try:
+            future = self._pool.submit(player.think, game)
+            self._idle[player] = idle
+            future.add_done_callback(done)
+            if player.interactive:
+                return future.result()
+            try:
+                return future.result(timeout=self.time_limit)
+            except TimeoutError:
+                cancel.set()
+            try:
+                return future.result(timeout=self.grace)
+            except TimeoutError:
+                if best and best[-1] is not None:
+                    return best[-1]
+                return future.result()
+        finally:
+            # the moves of a think still running are no longer passed on
+            player.progress_callback = None
+            self._cancel = None
+
+    def cancel(self):
+        """Ask the player thinking now to return as soon as possible."""
+        cancel = self._cancel
+        if cancel is not None:
+            cancel.set()
+
+    def shutdown(self):
+        self.cancel()
+        self._pool.shutdown(wait=False)
@@ -0,0 +1,213 @@
+# Threat-space search for forced wins: continuous fours (VCF) and fours or open threes (VCT).
+import time
+
+from game import Board
+from utils import get_matcher, line_tables
+
+# shapes of one color, written for black; reversed shapes are matched too
+FOUR_SHAPES = ['bbbb.', 'bbb.b', 'bb.bb']
+THREE_SHAPES = ['.bbb..', '.bb.b.']
+# five-cell windows with three stones and two empty cells, one move away from a four
+SPLIT_THREE_SHAPES = ['bbb..', 'bb.b.', 'bb..b', 'b.bb.', 'b.b.b', '.bbb.']
+
+
+def _colored(shapes, color):
+    return [shape.replace('b', color) for shape in shapes]
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class ThreatSolver:
+    """Search for a forced win made of threats only.
+
+    A four is a five-cell window with four stones of one color and an empty
+    cell, so the opponent has to take that cell. An open three is a shape that
+    becomes an open four unless the opponent answers inside it. vcf() only
+    plays fours; vct() also plays open threes, for which every empty cell of
+    the three and every reply making a four of the defender is tried. A
+    defender four is treated as a refutation, so vct() may miss wins that
+    need to block it first, but does not report a win the defender can stop
+    by answering the three.
+
+    The search runs on one board with push/pop and stops after node_budget
+    nodes or time_limit seconds. The shapes are those of five in a row, so
+    boards with another win length are never searched.
+
+    :param max_depth: Maximum number of threats played by the attacker.
+    :param max_threes: Maximum number of open threes among them, for vct().
+    :param node_budget: Maximum number of attacker nodes per search.
+    :param time_limit: Maximum seconds per search, or None.
+    """
+    def __init__(self, max_depth=10, max_threes=3, node_budget=20000, time_limit=None):
+        self.max_depth = max_depth
+        self.max_threes = max_threes
+        self.node_budget = node_budget
+        self.time_limit = time_limit
+        self._patterns = []
+        self._fours = {}
+        self._threes = {}
+        self._split_threes = {}
+        for color in ['b', 'w']:
+            start = len(self._patterns)
+            self._patterns += _colored(FOUR_SHAPES, color)
+            self._fours[color] = range(start, len(self._patterns))
+            start = len(self._patterns)
+            self._patterns += _colored(THREE_SHAPES, color)
+            self._threes[color] = range(start, len(self._patterns))
+            start = len(self._patterns)
+            self._patterns += _colored(SPLIT_THREE_SHAPES, color)
+            self._split_threes[color] = range(start, len(self._patterns))
+        self.nodes = 0
+        self.stats = {}
+
+    def vcf(self, board):
+        """Return a winning line of fours and forced replies for the side to move, or None.
+
+        The board is not modified.
+        """
+        return self._solve(board, threes=0)
+
+    def vct(self, board):
+        """Like vcf, but the attacker may also play open threes. Only the main line is returned."""
+        return self._solve(board, threes=0) or self._solve(board, threes=self.max_threes)
+
+    def _solve(self, board, threes):
+        if board.win_length != 5:
+            return None
+        board = Board(board.board, patterns=self._patterns)
+        self._attacker = 'b' if board.num_stone % 2 == 0 else 'w'
+        self._defender = 'w' if self._attacker == 'b' else 'b'
+        self.nodes = 0
+        # hash -> (depth, threes) of a search of the position that found no win
+        self._failed = {}
+        start = time.time()
+        self._deadline = start + self.time_limit if self.time_limit else None
+
+        line = None
+        exhausted = False
+        if board.get_state() == 0:
+            try:
+                line = self._attack(board, self.max_depth, threes)
+            except BudgetExceeded:
+                exhausted = True
+
+        elapsed = time.time() - start
+        self.stats = {'nodes': self.nodes, 'time': elapsed,
+                      'nodes_per_sec': self.nodes / elapsed if elapsed else 0,
+                      'exhausted': exhausted, 'found': line is not None}
+        return line
+
+    def _has_four(self, board, color):
+        return any(board.occurrence[i] for i in self._fours[color])
+
+    def _can_make_four(self, board, color):
+        return any(board.occurrence[i] for i in self._split_threes[color])
+
+    def _attack(self, board, depth, threes):
+        self.nodes += 1
+        if self.nodes > self.node_budget or (self._deadline and time.time() > self._deadline):
+            raise BudgetExceeded()
+
+        if self._has_four(board, self._attacker):
+            for move in self._five_points_anywhere(board):
+                return [move]
+        if self._has_four(board, self._defender) or depth == 0:
+            return None
+        failed = self._failed.get(board.hash)
+        if failed and failed[0] >= depth and failed[1] >= threes:
+            return None
+
+        for move, is_four in self._threat_moves(board, threes):
+            board.push(move)
+            if is_four:
+                replies = self._five_points(board, move, self._attacker)
+                if len(replies) > 1:
+                    board.pop()
+                    return [move]
+            else:
+                replies = self._three_defenses(board, move)
+                if replies is None:
+                    board.pop()
+                    continue
+
+            line = main = None
+            for reply in replies:
+                board.push(reply)
+                if board.get_state() == 0:
+                    line = self._attack(board, depth - 1, threes if is_four else threes - 1)
+                    line = [move, reply] + line if line is not None else None
+                else:
+                    line = None
+                board.pop()
+                if line is None:
+                    break
+                if main is None:
+                    main = line
+            board.pop()
+            if line is not None:
+                return main
+        self._failed[board.hash] = (depth, threes)
+        return None
+
+    def _threat_moves(self, board, threes):
+        """Return (move, is_four) for moves making a four, or an open three if threes > 0, fours first."""
+        fours, three_moves = [], []
+        for move in board.get_legal_nearby_moves(2) or []:
+            delta = board.push(move)
+            if any(delta[i] > 0 for i in self._fours[self._attacker]):
+                fours.append((move, True))
+            elif threes > 0 and any(delta[i] > 0 for i in self._threes[self._attacker]):
+                three_moves.append((move, False))
+            board.pop()
+        return fours + three_moves
+
+    def _windows(self, board, move, shapes):
+        """Yield the cells of every window through move matching one of shapes."""
+        lines, offsets = board.lines_through(move)
+        all_lines, cell_lines = line_tables(board.size)
+        line_ids = cell_lines[move[0]][move[1]]
+        for k, start, j in get_matcher(shapes).find_at(lines, offsets):
+            length = len(shapes[j])
+            yield all_lines[line_ids[k][0]][start:start + length], lines[k][start:start + length]
+
+    def _five_points(self, board, move, color):
+        """Return the empty cells completing a five with a four through move."""
+        points = []
+        for cells, window in self._windows(board, move, _colored(FOUR_SHAPES, color)):
+            point = cells[window.index('.')]
+            if point not in points:
+                points.append(point)
+        return points
+
+    def _five_points_anywhere(self, board):
+        """Yield the moves winning at once."""
+        for move in board.get_legal_nearby_moves(1) or []:
+            board.push(move)
+            won = board.get_state() in [1, 2]
+            board.pop()
+            if won:
+                yield move
+
+    def _three_defenses(self, board, move):
+        """Return the defender replies to an open three made by move, or None if the defender can make a four."""
+        defenses = []
+        for cells, window in self._windows(board, move, _colored(THREE_SHAPES, self._attacker)):
+            for cell, stone in zip(cells, window):
+                if stone == '.' and cell not in defenses:
+                    defenses.append(cell)
+        if self._can_make_four(board, self._defender):
+            return None
+        return defenses
+
+
+if __name__ == '__main__':
+    solver = ThreatSolver()
+    board = Board()
+    # black has a three on row 7 blocked by white at (7, 4), and two stones in column 8
+    for move in [(7, 5), (7, 4), (7, 6), (0, 0), (7, 7), (0, 2), (5, 8), (0, 4), (6, 8), (0, 6)]:
+        board.put_stone(move)
+    print(board)
+    print('VCF', solver.vcf(board), solver.stats)
+    print('VCT', solver.vct(board), solver.stats)
@@ -0,0 +1,273 @@
+# Offline trainer: train the critic on recorded games with TD(lambda) targets.
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+import config
+from game import Board, game_transitions
+from game_record import read_records
+from utils import file_to_patterns
+
+# patterns of a worker process, set by _init_worker
+_patterns = None
+
+
+def _init_worker(patterns):
+    global _patterns
+    _patterns = patterns
+
+
+def game_samples(record):
+    """Return the features of every position of a game and the rewards of its moves.
+
+    features has one row more than rewards: the position before every move, then the final position.
+    """
+    moves, state, size, win_length = record
+    features = []
+    rewards = []
+    for current, reward, following in game_transitions(moves, _patterns, size, win_length):
+        if not features:
+            features.append(current)
+        features.append(following)
+        rewards.append(reward)
+    return np.array(features, dtype=np.float32), np.array(rewards, dtype=np.float32)
+
+
+def lambda_returns(rewards, values, discount, lam):
+    """Return the TD(lambda) return of every move of a finished game.
+
+    values[t] is the critic's value of the position after move t. The game
+    is over after the last move, so its return is only its reward.
+    """
+    returns = np.empty(len(rewards), dtype=np.float32)
+    g = returns[-1] = rewards[-1]
+    for t in range(len(rewards) - 2, -1, -1):
+        g = returns[t] = rewards[t] + discount * ((1. - lam) * values[t] + lam * g)
+    return returns
+
+
+class ShuffleWindow:
+    """Bounded shuffle buffer. Once it is full, every sample added pushes a random one out.
+
+    Every sample carries the index of the game it comes from, so that the
+    games not fully trained on can be told apart.
+    """
+    def __init__(self, capacity, feature_size):
+        self.capacity = capacity
+        self._features = np.zeros([capacity, feature_size], dtype=np.float32)
+        self._targets = np.zeros([capacity, 1], dtype=np.float32)
+        self._games = np.zeros(capacity, dtype=np.int64)
+        self._size = 0
+        self._rng = np.random.default_rng()
+
+    def __len__(self):
+        return self._size
+
+    def add(self, features, targets, game):
+        """Add the samples of game. Return the (features, targets, games) they pushed out."""
+        n = min(len(features), self.capacity - self._size)
+        self._features[self._size:self._size + n] = features[:n]
+        self._targets[self._size:self._size + n] = targets[:n]
+        self._games[self._size:self._size + n] = game
+        self._size += n
+        out_features, out_targets, out_games = [], [], []
+        for start in range(n, len(features), self.capacity):
+            rest = slice(start, min(start + self.capacity, len(features)))
+            # distinct slots, so that no sample added here is pushed out by the same call
+            index = self._rng.choice(self.capacity, rest.stop - rest.start, replace=False)
+            out_features.append(self._features[index])
+            out_targets.append(self._targets[index])
+            out_games.append(self._games[index])
+            self._features[index] = features[rest]
+            self._targets[index] = targets[rest]
+            self._games[index] = game
+        if not out_features:
+            return features[:0], targets[:0], self._games[:0]
+        return np.concatenate(out_features), np.concatenate(out_targets), np.concatenate(out_games)
+
+    def drain(self):
+        """Remove and return all samples in random order."""
+        index = self._rng.permutation(self._size)
+        self._size = 0
+        return self._features[index], self._targets[index], self._games[index]
+
+    def oldest_game(self):
+        """Return the lowest game index of the samples in the window, or None if it is empty."""
+        return int(self._games[:self._size].min()) if self._size else None
+
+
+class OfflineTrainer:
+    """Cut samples into minibatches, train the critic on them and checkpoint on a schedule.
+
+    :param schedule: CheckpointPolicy deciding when to save the critic and the training progress.
+    :param window: ShuffleWindow the samples come through, if any; the games with samples still in it
+        are not counted as trained on.
+    """
+    def __init__(self, critic, batch_size, schedule, progress_path, report_every=100, window=None):
+        self.critic = critic
+        self.batch_size = batch_size
+        self.schedule = schedule
+        self.progress_path = progress_path
+        self.report_every = report_every
+        self.window = window
+        self.steps = 0
+        self.samples = 0
+        # number of games read so far, including the ones skipped when resuming
+        self.games = 0
+        self._pending_features = []
+        self._pending_targets = []
+        self._pending_games = []
+        self._pending = 0
+        self._start = time.time()
+
+    def load_progress(self):
+        """Return the number of games trained on before, as saved with the last checkpoint."""
+        if not os.path.exists(self.progress_path):
+            return 0
+        with open(self.progress_path) as f:
+            return json.load(f)['games']
+
+    def add(self, features, targets, games):
+        """Add samples with the index of the game each comes from, and train on the full minibatches."""
+        self._pending_features.append(features)
+        self._pending_targets.append(targets)
+        self._pending_games.append(games)
+        self._pending += len(features)
+        if self._pending >= self.batch_size:
+            features = np.concatenate(self._pending_features)
+            targets = np.concatenate(self._pending_targets)
+            games = np.concatenate(self._pending_games)
+            n = len(features) - len(features) % self.batch_size
+            for i in range(0, n, self.batch_size):
+                # the games of the samples not trained on yet, seen by a checkpoint taken in _train
+                self._pending_games = [games[i + self.batch_size:]]
+                self._train(features[i:i + self.batch_size], targets[i:i + self.batch_size])
+            self._pending_features = [features[n:]]
+            self._pending_targets = [targets[n:]]
+            self._pending = len(features) - n
+
+    def flush(self):
+        """Train on the samples left, even if they do not fill a minibatch, and checkpoint."""
+        if self._pending:
+            features, targets = np.concatenate(self._pending_features), np.concatenate(self._pending_targets)
+            self._pending_games = []
+            self._train(features, targets)
+        self._pending_features, self._pending_targets, self._pending_games, self._pending = [], [], [], 0
+        self.checkpoint()
+
+    def trained_games(self):
+        """Return the number of games read whose samples have all been trained on.
+
+        Games are counted in the order they were read, up to the first one with
+        samples still pending or in the window.
+        """
+        oldest = [self.games] + [int(g.min()) for g in self._pending_games if len(g)]
+        if self.window is not None and self.window.oldest_game() is not None:
+            oldest.append(self.window.oldest_game())
+        return min(oldest)
+
+    def checkpoint(self):
+        """Save the critic, then the number of games trained on, so that a resumed run starts after them.
+
+        A resumed run reads again the games with samples still waiting to be
+        trained on, so some of their samples are trained on twice.
+        """
+        self.critic.save()
+        tmp_path = '%s.tmp-%d' % (self.progress_path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump({'games': self.trained_games(), 'steps': self.steps}, f)
+        os.replace(tmp_path, self.progress_path)
+        self.schedule.saved()
+
+    def _train(self, features, targets):
+        self.critic.run_train_targets(targets, features)
+        self.steps += 1
+        self.samples += len(features)
+        if self.schedule.step():
+            self.checkpoint()
+        if self.steps % self.report_every == 0:
+            print('%d steps, %d games, %.0f samples/sec' % (self.steps, self.games, self.samples_per_sec()))
+
+    def samples_per_sec(self):
+        return self.samples / (time.time() - self._start)
+
+
+def train(paths, model_dir='model/', workers=multiprocessing.cpu_count(), batch_size=1024, window=100000,
+          lam=0.7, discount=0.9, epochs=1, save_every_steps=500, save_every_seconds=300., resume=True):
+    """Train the critic in model_dir on the game records in paths.
+
+    Features are extracted by worker processes. TD(lambda) returns are
+    computed with the critic's current values when a game is read, and its
+    samples go through a shuffle window of window samples before being
+    trained on in minibatches of batch_size.
+
+    :param resume: Skip the games trained on before, as saved with the last checkpoint.
+    :return: Samples trained on per second.
+    """
+    from rl_network.checkpoint import CheckpointPolicy
+    from rl_network.critic_network import CriticNN
+
+    patterns = file_to_patterns(config.pattern_file_name)
+    feature_size = len(Board(patterns=patterns).get_features())
+    # the checkpoint, if any, is restored by CriticNN; saving is left to the trainer
+    critic = CriticNN(feature_size, discount=discount, model_dir=model_dir,
+                      checkpoint_policy=CheckpointPolicy(every_steps=None, every_seconds=None,
+                                                         on_game_end=False, at_shutdown=False))
+    shuffle = ShuffleWindow(window, feature_size)
+    trainer = OfflineTrainer(critic, batch_size,
+                             CheckpointPolicy(every_steps=save_every_steps, every_seconds=save_every_seconds),
+                             os.path.join(model_dir, 'train_progress.json'), window=shuffle)
+    skip = trainer.load_progress() if resume else 0
+    if skip:
+        print('resuming after %d games' % skip)
+    trainer.games = skip
+
+    records = itertools.chain.from_iterable(read_records(paths) for _ in range(epochs))
+    records = itertools.islice(records, skip, None)
+    # the trainer process holds a TensorFlow session, so workers are spawned, not forked
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers, initializer=_init_worker, initargs=(patterns,)) as pool:
+        # one chunk of games is extracted while the one before is trained on, and no more
+        chunks = iter(lambda: list(itertools.islice(records, workers * 16)), [])
+        chunk = next(chunks, None)
+        pending = pool.map_async(game_samples, chunk, chunksize=16) if chunk else None
+        while pending is not None:
+            samples = pending.get()
+            chunk = next(chunks, None)
+            pending = pool.map_async(game_samples, chunk, chunksize=16) if chunk else None
+            for features, rewards in samples:
+                game, trainer.games = trainer.games, trainer.games + 1
+                if not len(rewards):
+                    continue
+                values = critic.run_value(features[1:])[:, 0]
+                targets = lambda_returns(rewards, values, discount, lam)
+                trainer.add(*shuffle.add(features[:-1], targets[:, None], game))
+    trainer.add(*shuffle.drain())
+    trainer.flush()
+    return trainer.samples_per_sec()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train the critic network on recorded games.')
+    parser.add_argument('records', nargs='+', help='game record directories or files')
+    parser.add_argument('-w', '--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--model-dir', default='model/')
+    parser.add_argument('--batch-size', type=int, default=1024)
+    parser.add_argument('--window', type=int, default=100000, help='samples in the shuffle window')
+    parser.add_argument('--lambda', dest='lam', type=float, default=0.7)
+    parser.add_argument('--discount', type=float, default=0.9)
+    parser.add_argument('--epochs', type=int, default=1)
+    parser.add_argument('--save-every-steps', type=int, default=500)
+    parser.add_argument('--save-every-seconds', type=float, default=300.)
+    parser.add_argument('--restart', action='store_true', help='do not skip the games trained on before')
+    args = parser.parse_args()
+    print('%.0f samples/sec' % train(args.records, model_dir=args.model_dir, workers=args.workers,
+                                     batch_size=args.batch_size, window=args.window, lam=args.lam,
+                                     discount=args.discount, epochs=args.epochs,
+                                     save_every_steps=args.save_every_steps,
+                                     save_every_seconds=args.save_every_seconds, resume=not args.restart))
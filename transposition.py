@@ -0,0 +1,85 @@
+# Transposition table for search players.
+import sys
+
+# bound types of a stored value
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+# approximate bytes of one entry: the tuple, the 64-bit key and the value
+ENTRY_BYTES = sys.getsizeof((0,) * 6) + sys.getsizeof(2**63) + sys.getsizeof(2**20)
+
+
+class TranspositionTable:
+    """Fixed-size table of search results keyed by Board.hash.
+
+    Entries are (key, value, depth, bound, move, generation) tuples. With
+    policy='depth' a slot keeps the deeper of the old and the new entry,
+    unless the old one comes from an earlier search. With policy='two-tier'
+    every slot has a depth-preferred entry and an always-replace entry.
+
+    :param size: Number of slots, rounded up to a power of two.
+    :param policy: 'depth' or 'two-tier'.
+    """
+    def __init__(self, size=2**18, policy='depth'):
+        if policy not in ['depth', 'two-tier']:
+            raise Exception('policy should be "depth" or "two-tier"')
+        self.policy = policy
+        self.size = 1 << max(size - 1, 1).bit_length()
+        self._mask = self.size - 1
+        self._tiers = 2 if policy == 'two-tier' else 1
+        self._table = [None] * (self.size * self._tiers)
+        self._generation = 0
+        # number of filled slots, kept by put so that stats does not walk the table
+        self.entries = 0
+        self.clear_stats()
+
+    def clear_stats(self):
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.replacements = 0
+
+    def new_search(self):
+        """Mark the entries stored so far as old, so that they are replaced first."""
+        self._generation += 1
+
+    def get(self, key):
+        """Return (value, depth, bound, move) stored for key, or None."""
+        self.probes += 1
+        index = (key & self._mask) * self._tiers
+        for entry in self._table[index:index + self._tiers]:
+            if entry is not None and entry[0] == key:
+                self.hits += 1
+                return entry[1:5]
+        return None
+
+    def put(self, key, value, depth, bound, move=None):
+        self.stores += 1
+        entry = (key, value, depth, bound, move, self._generation)
+        index = (key & self._mask) * self._tiers
+        old = self._table[index]
+        if old is None or old[0] == key or old[5] != self._generation or depth >= old[2]:
+            if old is None:
+                self.entries += 1
+            elif old[0] != key:
+                self.replacements += 1
+                if self._tiers == 2:
+                    # the deep entry being replaced moves down to the always-replace tier
+                    self._store_second(index, old)
+            self._table[index] = entry
+        elif self._tiers == 2:
+            self._store_second(index, entry)
+
+    def _store_second(self, index, entry):
+        if self._table[index + 1] is None:
+            self.entries += 1
+        self._table[index + 1] = entry
+
+    def stats(self):
+        """Return hit rate, fill and approximate memory footprint in bytes, from running counters."""
+        return {'probes': self.probes, 'hits': self.hits,
+                'hit_rate': self.hits / self.probes if self.probes else 0.,
+                'stores': self.stores, 'replacements': self.replacements,
+                'entries': self.entries, 'slots': len(self._table),
+                'memory_bytes': sys.getsizeof(self._table) + self.entries * ENTRY_BYTES}
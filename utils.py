@@ -1,10 +1,10 @@
 # Utility module for gomoku game.
-import re
+import random
 
 
-def in_board(x, y):
-    """Check if the given position is in the board."""
-    return (0 <= x < 15) and (0 <= y < 15)
+def in_board(x, y, size=15):
+    """Check if the given position is in a size x size board."""
+    return (0 <= x < size) and (0 <= y < size)
 
 
 def str_to_board(string):
@@ -27,23 +27,24 @@ def diagonal_line(board, x, y, direction):
     :return: A list containing board info of the given direction on (x, y)
     """
     l = []
+    size = len(board)
     if direction == '\\':
-        while in_board(x, y):
+        while in_board(x, y, size):
             x -= 1
             y -= 1
         x += 1
         y += 1
-        while in_board(x, y):
+        while in_board(x, y, size):
             l.append(board[x][y])
             x += 1
             y += 1
     elif direction == '/':
-        while in_board(x, y):
+        while in_board(x, y, size):
             x -= 1
             y += 1
         x += 1
         y -= 1
-        while in_board(x, y):
+        while in_board(x, y, size):
             l.append(board[x][y])
             x += 1
             y -= 1
@@ -103,38 +104,175 @@ def extract_features(board, patterns):
     return feature
 
 
-def pattern_occurrence(board, patterns):
-    occurrence = [0] * len(patterns)
+def _build_line_tables(size):
+    """Return every line of a size x size board and, for every cell, the lines through it.
 
+    Lines are the rows, the columns, the '\\' diagonals and the '/' diagonals,
+    in that order. Each line is a tuple of (row, col) from its first cell, in
+    the same order as diagonal_line walks it.
+    """
     lines = []
-    # get horizontal lines
-    lines += [''.join(raw) for raw in board]
-    # get vertical lines
-    lines += [''.join(raw) for raw in zip(*board)]
-    # get '\' lines
-    # we start from the first row then the first column
-    for c in range(15):
-        line = ''.join(diagonal_line(board, c, 0, '\\'))
-        lines.append(line)
-    for r in range(1, 15):
-        line = ''.join(diagonal_line(board, 0, r, '\\'))
-        lines.append(line)
-    # get '/' lines
-    # we start from the first row then the last column
-    for c in range(15):
-        line = ''.join(diagonal_line(board, 0, c, '/'))
-        lines.append(line)
-    for r in range(1, 15):
-        line = ''.join(diagonal_line(board, r, 14, '/'))
-        lines.append(line)
-
-    for i, p in enumerate(patterns):
-        for line in lines:
-            _p = p.replace('.', '\.')
-            occurrence[i] += len(re.findall(r'(?=(%s))' % _p, line))
-            if p != p[::-1]:
-                occurrence[i] += len(re.findall(r'(?=(%s))' % _p, line[::-1]))
-    return occurrence
+    for r in range(size):
+        lines.append(tuple((r, c) for c in range(size)))
+    for c in range(size):
+        lines.append(tuple((r, c) for r in range(size)))
+    for d in range(1 - size, size):
+        lines.append(tuple((r, r - d) for r in range(size) if in_board(r, r - d, size)))
+    for s in range(2 * size - 1):
+        lines.append(tuple((r, s - r) for r in range(size) if in_board(r, s - r, size)))
+
+    cell_lines = [[[] for _ in range(size)] for _ in range(size)]
+    for line_id, line in enumerate(lines):
+        for offset, (r, c) in enumerate(line):
+            cell_lines[r][c].append((line_id, offset))
+    cell_lines = [[tuple(cell) for cell in row] for row in cell_lines]
+    return lines, cell_lines
+
+_line_tables = {}
+
+
+def line_tables(size):
+    """Return (lines, cell_lines) of a size x size board, building them on first use."""
+    if size not in _line_tables:
+        _line_tables[size] = _build_line_tables(size)
+    return _line_tables[size]
+
+# LINES[line_id] is a tuple of cells, and CELL_LINES[row][col] holds the
+# (line_id, offset) of the -, |, \ and / lines through (row, col), on the
+# standard 15 x 15 board.
+LINES, CELL_LINES = line_tables(15)
+
+
+def _build_zobrist(size, seed=20160501):
+    """Return random 64-bit keys for every stone color on every cell of a size x size board.
+
+    The keys come from a fixed seed, so hashes agree between processes and runs.
+    """
+    rng = random.Random(seed)
+    return {color: [[rng.getrandbits(64) for _ in range(size)] for _ in range(size)] for color in 'bw'}
+
+
+_zobrist_keys = {}
+
+
+def zobrist_keys(size):
+    """Return the Zobrist keys of a size x size board (see ZOBRIST), building them on first use."""
+    if size not in _zobrist_keys:
+        _zobrist_keys[size] = _build_zobrist(size)
+    return _zobrist_keys[size]
+
+# ZOBRIST[color][row][col] is the hash key of a stone of color on (row, col).
+ZOBRIST = zobrist_keys(15)
+
+
+def zobrist_hash(board):
+    """Return the Zobrist hash of a board in list representation."""
+    keys = zobrist_keys(len(board))
+    h = 0
+    for r, row in enumerate(board):
+        for c, stone in enumerate(row):
+            if stone != '.':
+                h ^= keys[stone][r][c]
+    return h
+
+
+def board_lines(board):
+    """Return all lines of the board (see LINES) as strings."""
+    return [''.join([board[r][c] for r, c in line]) for line in line_tables(len(board))[0]]
+
+
+def pattern_occurrence(board, patterns):
+    return get_matcher(patterns).count(board_lines(board))
+
+
+class PatternMatcher:
+    """Count the occurrence of patterns, and of their reversals, in lines.
+
+    Patterns are grouped by length into tables mapping every pattern string
+    (and its reversal) to the indices of the patterns it belongs to. Counting
+    a line is then a single pass of dictionary lookups per pattern length.
+    """
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self._tables = {}
+        for i, p in enumerate(self.patterns):
+            table = self._tables.setdefault(len(p), {})
+            for s in {p, p[::-1]}:
+                table.setdefault(s, []).append(i)
+
+    def count(self, lines):
+        """Return the occurrence of every pattern in the given lines."""
+        occurrence = [0] * len(self.patterns)
+        for length, table in self._tables.items():
+            for line in lines:
+                for i in range(len(line) - length + 1):
+                    hits = table.get(line[i:i + length])
+                    if hits:
+                        for j in hits:
+                            occurrence[j] += 1
+        return occurrence
+
+    def count_at(self, lines, offsets):
+        """Return the occurrence of every pattern in the windows covering offsets.
+
+        :param lines: Lines to search.
+        :param offsets: For each line, the index of the cell the windows must cover.
+        """
+        occurrence = [0] * len(self.patterns)
+        for length, table in self._tables.items():
+            for line, offset in zip(lines, offsets):
+                for i in range(max(0, offset - length + 1), min(offset, len(line) - length) + 1):
+                    hits = table.get(line[i:i + length])
+                    if hits:
+                        for j in hits:
+                            occurrence[j] += 1
+        return occurrence
+
+    def find_at(self, lines, offsets):
+        """Return (line_index, start, pattern_index) for every match in the windows covering offsets."""
+        matches = []
+        for length, table in self._tables.items():
+            for k, (line, offset) in enumerate(zip(lines, offsets)):
+                for i in range(max(0, offset - length + 1), min(offset, len(line) - length) + 1):
+                    hits = table.get(line[i:i + length])
+                    if hits:
+                        for j in hits:
+                            matches.append((k, i, j))
+        return matches
+
+
+def _build_neighbourhood(radius, size):
+    return [[tuple((r, c) for r in range(row - radius, row + radius + 1)
+                   for c in range(col - radius, col + radius + 1) if in_board(r, c, size))
+             for col in range(size)] for row in range(size)]
+
+
+_neighbourhoods = {}
+
+
+def neighbourhood(radius, size=15):
+    """Return a table of the cells within radius of (row, col), itself included, as [row][col]."""
+    if (radius, size) not in _neighbourhoods:
+        _neighbourhoods[radius, size] = _build_neighbourhood(radius, size)
+    return _neighbourhoods[radius, size]
+
+
+_matchers = {}
+
+
+def get_matcher(patterns):
+    """Return the PatternMatcher for patterns, building it on first use."""
+    key = tuple(patterns)
+    if key not in _matchers:
+        _matchers[key] = PatternMatcher(key)
+    return _matchers[key]
+
+
+def shaped_reward(occurrence, next_occurrence, weights):
+    """Return the reward for going from occurrence to next_occurrence when nobody has won."""
+    value = sum([a*b for a, b in zip(occurrence, weights)])
+    next_value = sum([a*b for a, b in zip(next_occurrence, weights)])
+    return 0.00001 * (next_value - value)
 
 
 def file_to_patterns(f):
@@ -143,21 +281,22 @@ def file_to_patterns(f):
     return patterns
 
 
-def get_state(board):
+def get_state(board, win_length=5):
     """Return board state. 0: none, 1: black, 2: white, 3: board full"""
-    for row in range(15):
-        for col in range(15):
+    size = len(board)
+    for row in range(size):
+        for col in range(size):
             for color in ['b', 'w']:
                 if board[row][col] == color:
                     win_flag = [1, 1, 1, 1]
-                    for i in range(1, 5):
-                        if row + i >= 15 or board[row + i][col] != color:
+                    for i in range(1, win_length):
+                        if row + i >= size or board[row + i][col] != color:
                             win_flag[0] = 0
-                        if col + i >= 15 or board[row][col + i] != color:
+                        if col + i >= size or board[row][col + i] != color:
                             win_flag[1] = 0
-                        if row + i >= 15 or col + i >= 15 or board[row + i][col + i] != color:
+                        if row + i >= size or col + i >= size or board[row + i][col + i] != color:
                             win_flag[2] = 0
-                        if row + i >= 15 or col - i < 0 or board[row + i][col - i] != color:
+                        if row + i >= size or col - i < 0 or board[row + i][col - i] != color:
                             win_flag[3] = 0
                     if any(win_flag):
                         return ['b', 'w'].index(color) + 1